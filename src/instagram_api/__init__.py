@@ -1,5 +1,11 @@
 from instagram_api.routes import InstagramAPI
+from instagram_api.warmer import CacheWarmer
+from instagram_api.deadline import Deadline
+from instagram_api.breaker import CircuitOpenError
 
 __all__ = [
+    "Deadline",
+    "CacheWarmer",
     "InstagramAPI",
+    "CircuitOpenError",
 ]
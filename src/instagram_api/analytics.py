@@ -0,0 +1,208 @@
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from instagram_api.cache import CacheLayer
+from instagram_api.tags import extract_hashtags
+from instagram_api.schema import Post, Follower, UserInfoResponse
+from instagram_api.schema.schema import (
+    AccountMetrics,
+    FollowersAnalysis,
+    InstagramInfo,
+    InstagramPost,
+    PostsResponse,
+    Follower as AnalysisFollower,
+)
+
+
+SECONDS_PER_WEEK = 7 * 24 * 3600
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError(
+            "numpy is required for analytics, install instagram-api[analytics]"
+        )
+
+
+class PostColumns:
+    # One entry per post, owner is the index of the account it belongs to
+    def __init__(self, posts_by_account: Sequence[Sequence[Post]]):
+        _require_numpy()
+        total = sum(len(posts) for posts in posts_by_account)
+        posts = [post for account in posts_by_account for post in account]
+
+        self.accounts = len(posts_by_account)
+        self.owner = np.repeat(
+            np.arange(self.accounts), [len(p) for p in posts_by_account]
+        )
+        self.like_count = np.fromiter(
+            (p.like_count for p in posts), dtype=np.int64, count=total
+        )
+        self.comment_count = np.fromiter(
+            (p.comment_count for p in posts), dtype=np.int64, count=total
+        )
+        self.reshare_count = np.fromiter(
+            (p.reshare_count for p in posts), dtype=np.int64, count=total
+        )
+        self.taken_at = np.fromiter(
+            (p.taken_at for p in posts), dtype=np.int64, count=total
+        )
+
+
+class FollowerColumns:
+    def __init__(self, followers_by_account: Sequence[Sequence[Follower]]):
+        _require_numpy()
+        total = sum(len(followers) for followers in followers_by_account)
+        followers = [f for account in followers_by_account for f in account]
+
+        self.accounts = len(followers_by_account)
+        self.owner = np.repeat(
+            np.arange(self.accounts), [len(f) for f in followers_by_account]
+        )
+        self.is_private = np.fromiter(
+            (f.is_private for f in followers), dtype=bool, count=total
+        )
+        self.is_verified = np.fromiter(
+            (f.is_verified for f in followers), dtype=bool, count=total
+        )
+
+
+def _ratio(numerator: "np.ndarray", denominator: "np.ndarray") -> "np.ndarray":
+    return np.divide(
+        numerator,
+        denominator,
+        out=np.zeros(len(numerator), dtype=np.float64),
+        where=denominator > 0,
+    )
+
+
+def post_metrics(
+    columns: PostColumns, follower_counts: "np.ndarray"
+) -> Dict[str, "np.ndarray"]:
+    n = columns.accounts
+    counts = np.bincount(columns.owner, minlength=n)
+    likes = np.bincount(columns.owner, weights=columns.like_count, minlength=n)
+    comments = np.bincount(columns.owner, weights=columns.comment_count, minlength=n)
+    reshares = np.bincount(columns.owner, weights=columns.reshare_count, minlength=n)
+
+    first = np.full(n, np.iinfo(np.int64).max)
+    last = np.full(n, np.iinfo(np.int64).min)
+    np.minimum.at(first, columns.owner, columns.taken_at)
+    np.maximum.at(last, columns.owner, columns.taken_at)
+    span = np.where(counts > 1, last - first, 0)
+
+    engagement = _ratio(_ratio(likes + comments + reshares, counts), follower_counts)
+    # Share of accounts in this batch with a lower engagement rate
+    lower = np.searchsorted(np.sort(engagement), engagement, side="left")
+    percentile = lower / max(n - 1, 1)
+
+    return {
+        "posts_analyzed": counts,
+        "avg_likes": _ratio(likes, counts),
+        "avg_comments": _ratio(comments, counts),
+        "avg_reshares": _ratio(reshares, counts),
+        "engagement_rate": engagement,
+        "engagement_percentile": percentile,
+        "posts_per_week": _ratio((counts - 1) * SECONDS_PER_WEEK, span),
+    }
+
+
+def follower_metrics(columns: FollowerColumns) -> Dict[str, "np.ndarray"]:
+    n = columns.accounts
+    counts = np.bincount(columns.owner, minlength=n)
+    private = np.bincount(columns.owner, weights=columns.is_private, minlength=n)
+    verified = np.bincount(columns.owner, weights=columns.is_verified, minlength=n)
+    return {
+        "followers_analyzed": counts,
+        "private_follower_ratio": _ratio(private, counts),
+        "verified_follower_ratio": _ratio(verified, counts),
+    }
+
+
+def account_metrics(
+    handles: Sequence[str],
+    infos: Sequence[Optional[UserInfoResponse]],
+    posts_by_account: Sequence[Sequence[Post]],
+    followers_by_account: Sequence[Sequence[Follower]],
+) -> List[AccountMetrics]:
+    _require_numpy()
+    follower_counts = np.array(
+        [info.data.follower_count if info else 0 for info in infos], dtype=np.int64
+    )
+    metrics = post_metrics(PostColumns(posts_by_account), follower_counts)
+    metrics.update(follower_metrics(FollowerColumns(followers_by_account)))
+
+    # Convert once per column instead of once per value
+    values = {name: column.tolist() for name, column in metrics.items()}
+    return [
+        AccountMetrics(
+            handle=handle, **{name: column[i] for name, column in values.items()}
+        )
+        for i, handle in enumerate(handles)
+    ]
+
+
+async def analyze_accounts(
+    cache: CacheLayer, handles: Sequence[str], chunk_size: int = 100
+) -> List[AccountMetrics]:
+    # Stale entries are good enough for analytics, and this never calls the API
+    infos = await cache.get_many_account_info(handles, chunk_size)
+    posts = await cache.get_many_account_posts(handles, chunk_size)
+    followers = await cache.get_many_account_followers(handles, chunk_size)
+    return account_metrics(
+        handles,
+        infos,
+        [p or [] for p in posts],
+        [f or [] for f in followers],
+    )
+
+
+def instagram_info(info: UserInfoResponse) -> InstagramInfo:
+    account = info.data
+    return InstagramInfo(
+        title=account.full_name,
+        handle=account.username,
+        bio=account.biography,
+        is_business=account.is_business,
+        followers_count=account.follower_count,
+        following_count=account.following_count,
+        posts_count=account.media_count,
+    )
+
+
+def posts_response(posts: Sequence[Post]) -> PostsResponse:
+    return PostsResponse(
+        posts=[
+            InstagramPost(
+                id=post.id,
+                text=post.caption.text,
+                image_url=post.media[0].url if post.media else "",
+                hashtags=extract_hashtags(post.caption.text),
+            )
+            for post in posts
+        ]
+    )
+
+
+def followers_analysis(
+    info: UserInfoResponse, followers: Sequence[Follower]
+) -> FollowersAnalysis:
+    # We only know account flags, so followers are grouped by those
+    groups: Dict[str, List[AnalysisFollower]] = {
+        "verified": [],
+        "public": [],
+        "private": [],
+    }
+    for follower in followers:
+        if follower.is_verified:
+            group = "verified"
+        elif follower.is_private:
+            group = "private"
+        else:
+            group = "public"
+        groups[group].append(AnalysisFollower(**follower.model_dump()))
+    return FollowersAnalysis(account=instagram_info(info), interest_groups=groups)
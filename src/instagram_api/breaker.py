@@ -0,0 +1,153 @@
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Literal, Optional, Tuple
+
+
+CircuitState = Literal["closed", "open", "half_open"]
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(
+            f"Circuit open for {endpoint}, retry in {retry_after:.1f} seconds"
+        )
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        window: int = 50,
+        min_calls: int = 10,
+        error_threshold: float = 0.5,
+        slow_call_duration: float = 10.0,
+        slow_call_threshold: float = 0.8,
+        open_duration: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_threshold = slow_call_threshold
+        self.open_duration = open_duration
+        self.half_open_max_calls = half_open_max_calls
+
+        # (failed, slow) for each of the most recent calls
+        self._calls: Deque[Tuple[bool, bool]] = deque(maxlen=window)
+        self._state: CircuitState = "closed"
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        # Bumped on every state change, so results of calls that started
+        # before it can be told apart from the ones that decide the new state
+        self._generation = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> CircuitState:
+        if (
+            self._state == "open"
+            and time.monotonic() - self._opened_at >= self.open_duration
+        ):
+            self._state = "half_open"
+            self._half_open_in_flight = 0
+            self._generation += 1
+        return self._state
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    @property
+    def retry_after(self) -> float:
+        if self.state != "open":
+            return 0.0
+        return self.open_duration - (time.monotonic() - self._opened_at)
+
+    def _rate(self, index: int) -> float:
+        if not self._calls:
+            return 0.0
+        return sum(call[index] for call in self._calls) / len(self._calls)
+
+    @property
+    def error_rate(self) -> float:
+        return self._rate(0)
+
+    @property
+    def slow_call_rate(self) -> float:
+        return self._rate(1)
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if (
+            state == "half_open"
+            and self._half_open_in_flight < self.half_open_max_calls
+        ):
+            self._half_open_in_flight += 1
+            return True
+        return False
+
+    def _current(self, generation: Optional[int]) -> bool:
+        return generation is None or generation == self._generation
+
+    def release(self, generation: Optional[int] = None):
+        # A trial call ended without telling us anything about the upstream
+        if (
+            self.state == "half_open"
+            and self._current(generation)
+            and self._half_open_in_flight > 0
+        ):
+            self._half_open_in_flight -= 1
+
+    def _open(self):
+        self._state = "open"
+        self._opened_at = time.monotonic()
+        self._generation += 1
+        self.times_opened += 1
+
+    def _close(self):
+        self._state = "closed"
+        self._calls.clear()
+        self._generation += 1
+
+    def _record(self, failed: bool, latency: float, generation: Optional[int]):
+        slow = latency >= self.slow_call_duration
+        state = self.state
+        # Calls still finishing from before the last state change, like the
+        # ones that were in flight when the breaker opened, don't count
+        if state == "open" or not self._current(generation):
+            return
+        if state == "half_open":
+            self.release()
+            if failed or slow:
+                self._open()
+            else:
+                self._close()
+            return
+
+        self._calls.append((failed, slow))
+        if len(self._calls) < self.min_calls:
+            return
+        if (
+            self.error_rate >= self.error_threshold
+            or self.slow_call_rate >= self.slow_call_threshold
+        ):
+            self._open()
+
+    def record_success(self, latency: float, generation: Optional[int] = None):
+        self._record(False, latency, generation)
+
+    def record_failure(self, latency: float, generation: Optional[int] = None):
+        self._record(True, latency, generation)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "calls": len(self._calls),
+            "error_rate": self.error_rate,
+            "slow_call_rate": self.slow_call_rate,
+            "times_opened": self.times_opened,
+            "retry_after": self.retry_after,
+        }
@@ -1,9 +1,10 @@
 import pickle
 import logging
-from typing import Optional, List
+from typing import Optional, List, Tuple, Sequence, Any
 
 from redis.asyncio import Redis
 
+from instagram_api.tags import TagIndex
 from instagram_api.schema.media_likes import LikesUser
 from instagram_api.schema import (
     Post,
@@ -15,98 +16,273 @@ from instagram_api.schema import (
 
 logger = logging.getLogger(__package__)
 
+ACCESS_KEY = "access_frequency"
+
+# Read an entry and its TTL in one round trip, counting the access only when
+# the entry exists. Past max_tracked_keys the least used other key is dropped.
+READ_SCRIPT = """
+local ttl = redis.call("TTL", KEYS[1])
+local value
+if ARGV[3] == "list" then
+    value = redis.call("LRANGE", KEYS[1], 0, -1)
+else
+    value = redis.call("GET", KEYS[1])
+end
+if ARGV[1] == "1" and ttl ~= -2 then
+    redis.call("ZINCRBY", KEYS[2], 1, KEYS[1])
+    if redis.call("ZCARD", KEYS[2]) > tonumber(ARGV[2]) then
+        for _, key in ipairs(redis.call("ZRANGE", KEYS[2], 0, 1)) do
+            if key ~= KEYS[1] then
+                redis.call("ZREM", KEYS[2], key)
+                break
+            end
+        end
+    end
+end
+return {ttl, value}
+"""
+
+# Shorten the TTL of every key to at most ARGV[1], never lengthen it
+CAP_TTL_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    local ttl = redis.call("TTL", key)
+    if ttl == -1 or ttl > tonumber(ARGV[1]) then
+        redis.call("EXPIRE", key, ARGV[1])
+    end
+end
+"""
+
 
 class CacheLayer:
-    def __init__(self, redis_url: str, cache_duration: int = 3600):
+    def __init__(
+        self,
+        redis_url: str,
+        cache_duration: int = 3600,
+        stale_duration: int = 3600,
+        track_access: bool = True,
+        max_tracked_keys: int = 10_000,
+    ):
         self._redis = Redis.from_url(redis_url)
         self.cache_duration = cache_duration
+        # Entries are kept this much longer than cache_duration so they can
+        # still be served as a fallback while the upstream is unavailable
+        self.stale_duration = stale_duration
+        self.track_access = track_access
+        self.max_tracked_keys = max_tracked_keys
+        self.tags = TagIndex(self._redis)
+        self._read = self._redis.register_script(READ_SCRIPT)
+        self._cap_ttl = self._redis.register_script(CAP_TTL_SCRIPT)
+
+    @property
+    def _expiry(self) -> int:
+        return self.cache_duration + self.stale_duration
+
+    def _is_fresh(self, ttl: int) -> bool:
+        return ttl == -1 or ttl > self.stale_duration
+
+    async def _read_entry(self, key: str, kind: str) -> Tuple[int, Any]:
+        ttl, value = await self._read(
+            keys=[key, ACCESS_KEY],
+            args=[int(self.track_access), self.max_tracked_keys, kind],
+        )
+        return int(ttl), value
+
+    async def decay_access_counts(self, factor: float = 0.5):
+        # Scale every counter down so old popularity fades (approximate LFU)
+        await self._redis.zunionstore(ACCESS_KEY, {ACCESS_KEY: factor})
+        await self._redis.zremrangebyscore(ACCESS_KEY, "-inf", 0.5)
+
+    async def hot_keys(self, top_n: int) -> List[Tuple[str, float]]:
+        keys = await self._redis.zrevrange(ACCESS_KEY, 0, top_n - 1, withscores=True)
+        return [
+            (key.decode() if isinstance(key, bytes) else key, score)
+            for key, score in keys
+        ]
+
+    async def fresh_ttl(self, key: str) -> int:
+        ttl = await self._redis.ttl(key)
+        if ttl < 0:
+            return ttl
+        return max(0, ttl - self.stale_duration)
+
+    async def mark_stale(self, key: str):
+        # Keep the entry around as a fallback but stop serving it as fresh.
+        # An entry that is already stale keeps its remaining time.
+        await self._cap_ttl(keys=[key, f"pages:{key}"], args=[self.stale_duration])
+
+    async def _get_list(self, key: str, allow_stale: bool) -> Optional[List[Any]]:
+        ttl, items = await self._read_entry(key, "list")
+        if items and (allow_stale or self._is_fresh(ttl)):
+            return [pickle.loads(item) for item in items]
+        return None
+
+    async def cached_pages(self, key: str) -> int:
+        # How many pages of the upstream walk the cached list holds
+        pages = await self._redis.get(f"pages:{key}")
+        return int(pages) if pages else 0
+
+    async def _write_list(
+        self, key: str, items: Sequence[Any], replace: bool, pages: int = 1
+    ):
+        # Write a whole page in one round trip so there is nothing left pending
+        # once the page has been handed to the caller. Replacing happens in a
+        # transaction so readers never see a half refreshed list.
+        async with self._redis.pipeline(transaction=replace) as pipe:
+            if replace:
+                await pipe.delete(key, f"pages:{key}")
+            if items:
+                await pipe.execute_command(
+                    "RPUSH", key, *[pickle.dumps(item) for item in items]
+                )
+                await pipe.expire(key, self._expiry)
+            if pages:
+                await pipe.incrby(f"pages:{key}", pages)
+                await pipe.expire(f"pages:{key}", self._expiry)
+            await pipe.execute()
+
+    async def _get_many_lists(
+        self, keys: Sequence[str], chunk_size: int
+    ) -> List[Optional[List[Any]]]:
+        # Bulk reads for batch jobs: one round trip per chunk, stale entries
+        # included, and no access tracking so the batch doesn't look hot
+        results: List[Optional[List[Any]]] = []
+        for i in range(0, len(keys), chunk_size):
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for key in keys[i : i + chunk_size]:
+                    await pipe.execute_command("LRANGE", key, 0, -1)
+                chunk = await pipe.execute()
+            results.extend(
+                [pickle.loads(item) for item in items] if items else None
+                for items in chunk
+            )
+        return results
 
-    async def get_account_followers(self, handle: str) -> Optional[List[Follower]]:
+    async def get_account_followers(
+        self, handle: str, allow_stale: bool = False
+    ) -> Optional[List[Follower]]:
         key = f"followers:{handle}"
-        followers = await self._redis.execute_command("LRANGE", key, 0, -1)
+        followers = await self._get_list(key, allow_stale)
 
         if followers:
             logger.debug(f"Cache hit for followers of {handle}")
-            return [pickle.loads(follower) for follower in followers]
-        return None
+        return followers
+
+    async def get_many_account_followers(
+        self, handles: Sequence[str], chunk_size: int = 100
+    ) -> List[Optional[List[Follower]]]:
+        return await self._get_many_lists(
+            [f"followers:{handle}" for handle in handles], chunk_size
+        )
 
     async def cache_account_follower(self, handle: str, follower: Follower):
-        key = f"followers:{handle}"
-        follower_bytes = pickle.dumps(follower)
+        await self._write_list(
+            f"followers:{handle}", [follower], replace=False, pages=0
+        )
 
-        # Use pipeline to atomically add follower and set expiration
-        async with self._redis.pipeline() as pipe:
-            await pipe.execute_command("RPUSH", key, follower_bytes)
-            await pipe.expire(key, self.cache_duration)
-            await pipe.execute()
+    async def cache_account_followers(
+        self,
+        handle: str,
+        followers: List[Follower],
+        replace: bool = False,
+        pages: int = 1,
+    ):
+        await self._write_list(f"followers:{handle}", followers, replace, pages)
 
-    async def get_account_info(self, handle: str) -> Optional[UserInfoResponse]:
+    async def get_account_info(
+        self, handle: str, allow_stale: bool = False
+    ) -> Optional[UserInfoResponse]:
         key = f"account_info:{handle}"
-        info = await self._redis.get(key)
-
-        if info:
+        ttl, info = await self._read_entry(key, "value")
+        if info and (allow_stale or self._is_fresh(ttl)):
             logger.debug(f"Cache hit for account info of {handle}")
             return pickle.loads(info)
         return None
 
+    async def get_many_account_info(
+        self, handles: Sequence[str], chunk_size: int = 100
+    ) -> List[Optional[UserInfoResponse]]:
+        results: List[Optional[UserInfoResponse]] = []
+        for i in range(0, len(handles), chunk_size):
+            infos = await self._redis.mget(
+                [f"account_info:{handle}" for handle in handles[i : i + chunk_size]]
+            )
+            results.extend(pickle.loads(info) if info else None for info in infos)
+        return results
+
     async def cache_account_info(self, handle: str, info: UserInfoResponse):
         key = f"account_info:{handle}"
         info_bytes = pickle.dumps(info)
-        await self._redis.set(key, info_bytes, ex=self.cache_duration)
+        await self._redis.set(key, info_bytes, ex=self._expiry)
 
-    async def get_account_posts(self, handle: str) -> Optional[List[Post]]:
+    async def get_account_posts(
+        self, handle: str, allow_stale: bool = False
+    ) -> Optional[List[Post]]:
         key = f"posts:{handle}"
-        posts = await self._redis.execute_command("LRANGE", key, 0, -1)
+        posts = await self._get_list(key, allow_stale)
 
         if posts:
             logger.debug(f"Cache hit for posts of {handle}")
-            return [pickle.loads(post) for post in posts]
-        return None
+        return posts
+
+    async def get_many_account_posts(
+        self, handles: Sequence[str], chunk_size: int = 100
+    ) -> List[Optional[List[Post]]]:
+        return await self._get_many_lists(
+            [f"posts:{handle}" for handle in handles], chunk_size
+        )
 
     async def cache_account_post(self, handle: str, post: Post):
-        key = f"posts:{handle}"
-        post_bytes = pickle.dumps(post)
+        await self._write_list(f"posts:{handle}", [post], replace=False, pages=0)
+        await self.tags.add_posts([post])
 
-        # Use pipeline to atomically add post and set expiration
-        async with self._redis.pipeline() as pipe:
-            await pipe.execute_command("RPUSH", key, post_bytes)
-            await pipe.expire(key, self.cache_duration)
-            await pipe.execute()
+    async def cache_account_posts(
+        self, handle: str, posts: List[Post], replace: bool = False, pages: int = 1
+    ):
+        await self._write_list(f"posts:{handle}", posts, replace, pages)
+        await self.tags.add_posts(posts)
 
-    async def get_media_comments(self, media_id: str) -> Optional[List[Comment]]:
+    async def get_media_comments(
+        self, media_id: str, allow_stale: bool = False
+    ) -> Optional[List[Comment]]:
         key = f"comments:{media_id}"
-        comments = await self._redis.execute_command("LRANGE", key, 0, -1)
+        comments = await self._get_list(key, allow_stale)
 
         if comments:
             logger.debug(f"Cache hit for comments of media {media_id}")
-            return [pickle.loads(comment) for comment in comments]
-        return None
+        return comments
 
     async def cache_media_comment(self, media_id: str, comment: Comment):
-        key = f"comments:{media_id}"
-        comment_bytes = pickle.dumps(comment)
+        await self._write_list(
+            f"comments:{media_id}", [comment], replace=False, pages=0
+        )
 
-        # Use pipeline to atomically add comment and set expiration
-        async with self._redis.pipeline() as pipe:
-            await pipe.execute_command("RPUSH", key, comment_bytes)
-            await pipe.expire(key, self.cache_duration)
-            await pipe.execute()
+    async def cache_media_comments(
+        self,
+        media_id: str,
+        comments: List[Comment],
+        replace: bool = False,
+        pages: int = 1,
+    ):
+        await self._write_list(f"comments:{media_id}", comments, replace, pages)
 
-    async def get_media_likes(self, media_id: str) -> Optional[List[LikesUser]]:
+    async def get_media_likes(
+        self, media_id: str, allow_stale: bool = False
+    ) -> Optional[List[LikesUser]]:
         key = f"likes:{media_id}"
-        likes = await self._redis.execute_command("LRANGE", key, 0, -1)
+        likes = await self._get_list(key, allow_stale)
 
         if likes:
             logger.debug(f"Cache hit for likes of media {media_id}")
-            return [pickle.loads(like) for like in likes]
-        return None
+        return likes
 
     async def cache_media_like(self, media_id: str, likes: LikesUser):
-        key = f"likes:{media_id}"
-        likes_bytes = pickle.dumps(likes)
+        await self._write_list(f"likes:{media_id}", [likes], replace=False, pages=0)
 
-        # Use pipeline to atomically add likes and set expiration
-        async with self._redis.pipeline() as pipe:
-            await pipe.execute_command("RPUSH", key, likes_bytes)
-            await pipe.expire(key, self.cache_duration)
-            await pipe.execute()
+    async def cache_media_likes(
+        self,
+        media_id: str,
+        likes: List[LikesUser],
+        replace: bool = False,
+        pages: int = 1,
+    ):
+        await self._write_list(f"likes:{media_id}", likes, replace, pages)
@@ -0,0 +1,21 @@
+import time
+
+
+REQUEST_TIMEOUT = 30
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError("seconds must be greater than 0")
+        self._expires_at = time.monotonic() + seconds
+        # Set by the client when it stopped paginating because time ran out
+        self.partial = False
+
+    def remaining(self) -> float:
+        return max(0.0, self._expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
@@ -0,0 +1,203 @@
+import json
+import types
+import asyncio
+from typing import (
+    Any,
+    AsyncIterable,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+    get_args,
+    get_origin,
+)
+
+from pydantic import BaseModel
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+Column = Tuple[str, Any]
+
+
+def _unwrap_optional(annotation: Any) -> Any:
+    if get_origin(annotation) in (Union, types.UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _is_model(annotation: Any) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+def _model_fields(model: Type[BaseModel]) -> List[Column]:
+    # Mirrors model_dump(): excluded fields are dropped, computed fields kept
+    fields = [
+        (name, field.annotation)
+        for name, field in model.model_fields.items()
+        if not field.exclude
+    ]
+    fields += [
+        (name, field.return_type)
+        for name, field in model.model_computed_fields.items()
+    ]
+    return fields
+
+
+def flatten_schema(model: Type[BaseModel], prefix: str = "") -> List[Column]:
+    # Nested models become dotted columns, lists are kept as a single column
+    columns: List[Column] = []
+    for name, annotation in _model_fields(model):
+        inner = _unwrap_optional(annotation)
+        if _is_model(inner):
+            columns += flatten_schema(inner, f"{prefix}{name}.")
+        else:
+            columns.append((f"{prefix}{name}", annotation))
+    return columns
+
+
+def flatten_record(record: BaseModel, columns: List[Column]) -> Dict[str, Any]:
+    data = record.model_dump(mode="json")
+    row = {}
+    for name, _ in columns:
+        value: Any = data
+        for part in name.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        row[name] = value
+    return row
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError(
+            "pyarrow is required for columnar export, "
+            "install instagram-api[export]"
+        )
+
+
+def _arrow_type(annotation: Any) -> "pa.DataType":
+    annotation = _unwrap_optional(annotation)
+    origin = get_origin(annotation)
+
+    if origin is Literal:
+        return _arrow_type(type(get_args(annotation)[0]))
+    if origin in (list, List):
+        return pa.list_(_arrow_type(get_args(annotation)[0]))
+    if _is_model(annotation):
+        return pa.struct(
+            [(name, _arrow_type(field)) for name, field in _model_fields(annotation)]
+        )
+    if annotation is bool:
+        return pa.bool_()
+    if annotation is int:
+        return pa.int64()
+    if annotation is float:
+        return pa.float64()
+    return pa.string()
+
+
+def arrow_schema(model: Type[BaseModel]) -> "pa.Schema":
+    _require_pyarrow()
+    return pa.schema(
+        [(name, _arrow_type(annotation)) for name, annotation in flatten_schema(model)]
+    )
+
+
+async def export_ndjson(
+    records: AsyncIterable[BaseModel],
+    path: str,
+    batch_size: int = 1000,
+) -> int:
+    columns: Optional[List[Column]] = None
+    lines: List[str] = []
+    count = 0
+
+    with open(path, "w", encoding="utf-8") as f:
+        async for record in records:
+            if columns is None:
+                columns = flatten_schema(type(record))
+            lines.append(json.dumps(flatten_record(record, columns)) + "\n")
+            count += 1
+            if len(lines) >= batch_size:
+                await asyncio.to_thread(f.writelines, lines)
+                lines = []
+        if lines:
+            await asyncio.to_thread(f.writelines, lines)
+    return count
+
+
+async def _export_columnar(
+    records: AsyncIterable[BaseModel],
+    path: str,
+    model: Optional[Type[BaseModel]],
+    batch_size: int,
+    open_writer,
+) -> int:
+    writer = None
+    columns: List[Column] = []
+    schema = None
+    rows: List[Dict[str, Any]] = []
+    count = 0
+
+    async def flush():
+        batch = pa.RecordBatch.from_pylist(rows, schema=schema)
+        await asyncio.to_thread(writer.write_batch, batch)
+        rows.clear()
+
+    try:
+        async for record in records:
+            if writer is None:
+                model = model or type(record)
+                columns = flatten_schema(model)
+                schema = arrow_schema(model)
+                writer = open_writer(path, schema)
+            rows.append(flatten_record(record, columns))
+            count += 1
+            if len(rows) >= batch_size:
+                await flush()
+        if writer is None:
+            # Nothing came through, still leave a valid empty file behind
+            if model is None:
+                raise ValueError(
+                    "No records to export, pass model to write an empty file"
+                )
+            writer = open_writer(path, arrow_schema(model))
+        if rows:
+            await flush()
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+async def export_parquet(
+    records: AsyncIterable[BaseModel],
+    path: str,
+    model: Optional[Type[BaseModel]] = None,
+    row_group_size: int = 10_000,
+) -> int:
+    _require_pyarrow()
+    # Every flushed batch becomes its own row group
+    return await _export_columnar(
+        records, path, model, row_group_size, pq.ParquetWriter
+    )
+
+
+async def export_arrow(
+    records: AsyncIterable[BaseModel],
+    path: str,
+    model: Optional[Type[BaseModel]] = None,
+    batch_size: int = 10_000,
+) -> int:
+    _require_pyarrow()
+    return await _export_columnar(records, path, model, batch_size, pa.ipc.new_file)
@@ -0,0 +1,392 @@
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Literal, Optional, Sequence, Tuple
+
+from pydantic import BaseModel, Field
+from redis.asyncio import Redis
+
+from instagram_api.routes import InstagramAPI
+from instagram_api.breaker import CircuitOpenError
+from instagram_api.ratelimit import RateBudget
+
+
+logger = logging.getLogger(__package__)
+
+PENDING_KEY = "crawl:pending"
+DEAD_KEY = "crawl:dead"
+
+# Marking a target pending and queueing it happen together or not at all
+ENQUEUE_SCRIPT = """
+if redis.call("SADD", KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call("RPUSH", KEYS[2], ARGV[2])
+return 1
+"""
+
+# Move retries whose delay is up back onto the queue
+PROMOTE_SCRIPT = """
+local due = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+for _, job in ipairs(due) do
+    redis.call("ZREM", KEYS[1], job)
+    redis.call("RPUSH", KEYS[2], job)
+end
+return #due
+"""
+
+# Only the worker holding a lease may extend or release it
+RENEW_LEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+def shard_for(target: str, shards: int) -> int:
+    # Jump consistent hash: growing the shard count only moves ~1/n of targets
+    key = int.from_bytes(
+        hashlib.blake2b(target.lower().encode(), digest_size=8).digest(), "big"
+    )
+    bucket, jump = -1, 0
+    while jump < shards:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) % 2**64
+        jump = int((bucket + 1) * (2**31 / ((key >> 33) + 1)))
+    return bucket
+
+
+class CrawlJob(BaseModel):
+    kind: Literal["user_info", "user_posts", "user_followers", "media_comments"]
+    target: str
+    max_pagination: int = 1
+    attempts: int = 0
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind}:{self.target.lower()}"
+
+
+class CrawlQueue:
+    def __init__(
+        self,
+        redis: Redis,
+        shards: int = 16,
+        max_attempts: int = 3,
+        retry_delay: float = 5.0,
+        max_retry_delay: float = 300.0,
+        lease_duration: float = 30.0,
+    ):
+        self._redis = redis
+        self.shards = shards
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease_duration = lease_duration
+        self._enqueue = self._redis.register_script(ENQUEUE_SCRIPT)
+        self._promote = self._redis.register_script(PROMOTE_SCRIPT)
+        self._renew_lease = self._redis.register_script(RENEW_LEASE_SCRIPT)
+        self._release_lease = self._redis.register_script(RELEASE_LEASE_SCRIPT)
+
+    def _queue(self, shard: int) -> str:
+        return f"crawl:queue:{shard}"
+
+    def _processing(self, shard: int) -> str:
+        return f"crawl:processing:{shard}"
+
+    def _delayed(self, shard: int) -> str:
+        return f"crawl:delayed:{shard}"
+
+    def _lease(self, shard: int) -> str:
+        return f"crawl:lease:{shard}"
+
+    def _checkpoint(self, job: CrawlJob) -> str:
+        return f"crawl:checkpoint:{job.name}"
+
+    def shard_for(self, job: CrawlJob) -> int:
+        return shard_for(job.target, self.shards)
+
+    async def enqueue(self, job: CrawlJob) -> bool:
+        # The same target is only ever queued once until it is acked
+        added = await self._enqueue(
+            keys=[PENDING_KEY, self._queue(self.shard_for(job))],
+            args=[job.name, job.model_dump_json()],
+        )
+        return bool(added)
+
+    async def claim(
+        self, shard: int, timeout: float = 1
+    ) -> Optional[Tuple[bytes, CrawlJob]]:
+        raw = await self._redis.blmove(
+            self._queue(shard), self._processing(shard), timeout, "LEFT", "RIGHT"
+        )
+        if raw is None:
+            return None
+        return raw, CrawlJob.model_validate_json(raw)
+
+    async def ack(self, shard: int, raw: bytes, job: CrawlJob):
+        async with self._redis.pipeline() as pipe:
+            await pipe.lrem(self._processing(shard), 1, raw)
+            await pipe.srem(PENDING_KEY, job.name)
+            await pipe.delete(self._checkpoint(job))
+            await pipe.execute()
+
+    def backoff(self, job: CrawlJob) -> float:
+        return min(self.max_retry_delay, self.retry_delay * 2**job.attempts)
+
+    async def retry(
+        self,
+        shard: int,
+        raw: bytes,
+        job: CrawlJob,
+        delay: Optional[float] = None,
+        count_attempt: bool = True,
+    ):
+        # Retries wait in the delayed set until they are due, promote_due
+        # then puts them back on the queue
+        delay = self.backoff(job) if delay is None else delay
+        if count_attempt:
+            job = job.model_copy(update={"attempts": job.attempts + 1})
+        async with self._redis.pipeline() as pipe:
+            await pipe.lrem(self._processing(shard), 1, raw)
+            if job.attempts >= self.max_attempts:
+                await pipe.rpush(DEAD_KEY, job.model_dump_json())
+                await pipe.srem(PENDING_KEY, job.name)
+                await pipe.delete(self._checkpoint(job))
+            else:
+                await pipe.zadd(
+                    self._delayed(shard), {job.model_dump_json(): time.time() + delay}
+                )
+            await pipe.execute()
+
+    async def promote_due(self, shard: int, limit: int = 100) -> int:
+        return await self._promote(
+            keys=[self._delayed(shard), self._queue(shard)], args=[time.time(), limit]
+        )
+
+    async def delayed(self, shard: int) -> int:
+        return await self._redis.zcard(self._delayed(shard))
+
+    async def acquire_lease(self, shard: int, owner: str) -> bool:
+        return bool(
+            await self._redis.set(
+                self._lease(shard), owner, nx=True, px=int(self.lease_duration * 1000)
+            )
+        )
+
+    async def renew_lease(self, shard: int, owner: str) -> bool:
+        return bool(
+            await self._renew_lease(
+                keys=[self._lease(shard)],
+                args=[owner, int(self.lease_duration * 1000)],
+            )
+        )
+
+    async def release_lease(self, shard: int, owner: str):
+        await self._release_lease(keys=[self._lease(shard)], args=[owner])
+
+    async def requeue_in_flight(self, shard: int) -> int:
+        # Jobs a crashed worker had claimed but never acked go back in front.
+        # Only call this holding the shard's lease, anything in flight then
+        # belongs to a worker whose lease ran out.
+        moved = 0
+        while await self._redis.lmove(
+            self._processing(shard), self._queue(shard), "RIGHT", "LEFT"
+        ):
+            moved += 1
+        return moved
+
+    async def checkpoint(self, job: CrawlJob, cursor: Optional[str], pages: int):
+        await self._redis.hset(
+            self._checkpoint(job), mapping={"cursor": cursor or "", "pages": pages}
+        )
+
+    async def get_checkpoint(self, job: CrawlJob) -> Tuple[Optional[str], int]:
+        checkpoint = await self._redis.hgetall(self._checkpoint(job))
+        if not checkpoint:
+            return None, 0
+        return checkpoint[b"cursor"].decode() or None, int(checkpoint[b"pages"])
+
+
+class CrawlWorker:
+    def __init__(
+        self,
+        api: InstagramAPI,
+        queue: CrawlQueue,
+        shards: Sequence[int],
+        stop_when_idle: bool = False,
+    ):
+        self._api = api
+        self._queue = queue
+        self.shards = shards
+        self.stop_when_idle = stop_when_idle
+        self.owner = uuid.uuid4().hex
+
+    async def process(self, job: CrawlJob):
+        if job.kind == "user_info":
+            # Stale data is no crawl, an open circuit has to reach the retry path
+            await self._api.user_info(job.target, allow_stale=False)
+            return
+
+        cursor, pages = await self._queue.get_checkpoint(job)
+        if pages and cursor is None:
+            # Every page was fetched before the worker died, only the ack is missing
+            return
+
+        async def on_page(next_cursor: Optional[str]):
+            nonlocal pages
+            pages += 1
+            await self._queue.checkpoint(job, next_cursor, pages)
+
+        remaining = job.max_pagination - pages
+        if remaining < 1:
+            return
+        walk = {
+            "user_posts": self._api.user_posts,
+            "user_followers": self._api.user_followers,
+            "media_comments": self._api.media_comments,
+        }[job.kind]
+        # Results land in the cache, there is nothing else to do with them here
+        async for _ in walk(
+            job.target, remaining, cursor=cursor, on_page=on_page, allow_stale=False
+        ):
+            pass
+
+    async def _heartbeat(self, shard: int, lost: asyncio.Event):
+        while True:
+            await asyncio.sleep(self._queue.lease_duration / 3)
+            try:
+                renewed = await self._queue.renew_lease(shard, self.owner)
+            except Exception as e:
+                # Without a renewal the lease may run out, assume another worker has it
+                logger.warning(f"Renewing the lease on shard {shard} failed: {str(e)}")
+                renewed = False
+            if not renewed:
+                lost.set()
+                return
+
+    async def run_shard(self, shard: int):
+        # A shard has one owner at a time, whichever worker holds its lease
+        while True:
+            if not await self._queue.acquire_lease(shard, self.owner):
+                if self.stop_when_idle:
+                    return
+                await asyncio.sleep(self._queue.lease_duration / 3)
+                continue
+
+            lost = asyncio.Event()
+            heartbeat = asyncio.create_task(self._heartbeat(shard, lost))
+            try:
+                await self._work_shard(shard, lost)
+            finally:
+                heartbeat.cancel()
+                await asyncio.gather(heartbeat, return_exceptions=True)
+                await self._queue.release_lease(shard, self.owner)
+            if not lost.is_set():
+                return
+            logger.warning(f"Lost the lease on shard {shard}")
+
+    async def _work_shard(self, shard: int, lost: asyncio.Event):
+        requeued = await self._queue.requeue_in_flight(shard)
+        if requeued:
+            logger.info(f"Requeued {requeued} unacked jobs on shard {shard}")
+
+        while not lost.is_set():
+            await self._queue.promote_due(shard)
+            claimed = await self._queue.claim(shard)
+            if claimed is None:
+                if self.stop_when_idle and not await self._queue.delayed(shard):
+                    return
+                continue
+
+            raw, job = claimed
+            try:
+                await self.process(job)
+            except CircuitOpenError as e:
+                # Not the job's fault, wait the breaker out without using an attempt
+                logger.info(f"Crawl job {job.name} postponed: {str(e)}")
+                await self._queue.retry(
+                    shard,
+                    raw,
+                    job,
+                    delay=max(e.retry_after, self._queue.backoff(job)),
+                    count_attempt=False,
+                )
+            except Exception as e:
+                logger.warning(f"Crawl job {job.name} failed: {str(e)}")
+                await self._queue.retry(shard, raw, job)
+            else:
+                await self._queue.ack(shard, raw, job)
+
+    async def run(self):
+        await asyncio.gather(*[self.run_shard(shard) for shard in self.shards])
+
+
+async def _run_worker(
+    url: str,
+    api_key: str,
+    redis_url: str,
+    shards: int,
+    shard_ids: List[int],
+    requests_per_second: int,
+    stop_when_idle: bool,
+):
+    redis = Redis.from_url(redis_url)
+    api = InstagramAPI(
+        url,
+        api_key,
+        redis_url,
+        rate_budget=RateBudget(redis, requests_per_second),
+    )
+    queue = CrawlQueue(redis, shards)
+    await CrawlWorker(api, queue, shard_ids, stop_when_idle).run()
+
+
+def _worker_main(*args):
+    asyncio.run(_run_worker(*args))
+
+
+def run_workers(
+    url: str,
+    api_key: str,
+    redis_url: str,
+    shards: int = 16,
+    shard_ids: Optional[Sequence[int]] = None,
+    processes: Optional[int] = None,
+    requests_per_second: int = 10,
+    stop_when_idle: bool = False,
+):
+    # Shard leases keep each shard to one worker, so nodes may pass
+    # overlapping shard_ids and take over shards from nodes that die
+    shard_ids = list(range(shards)) if shard_ids is None else list(shard_ids)
+    processes = min(processes or os.cpu_count() or 1, len(shard_ids))
+
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [
+            pool.submit(
+                _worker_main,
+                url,
+                api_key,
+                redis_url,
+                shards,
+                shard_ids[i::processes],
+                requests_per_second,
+                stop_when_idle,
+            )
+            for i in range(processes)
+        ]
+        for future in futures:
+            future.result()
@@ -0,0 +1,68 @@
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from instagram_api.deadline import REQUEST_TIMEOUT
+
+
+class LatencyHistogram:
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+
+class LatencyTracker:
+    def __init__(
+        self,
+        window: int = 200,
+        min_samples: int = 20,
+        timeout_multiplier: float = 4.0,
+        min_timeout: float = 5.0,
+        max_timeout: float = REQUEST_TIMEOUT,
+    ):
+        self.window = window
+        self.min_samples = min_samples
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._histograms: Dict[str, LatencyHistogram] = {}
+
+    def record(self, endpoint: str, seconds: float):
+        if endpoint not in self._histograms:
+            self._histograms[endpoint] = LatencyHistogram(self.window)
+        self._histograms[endpoint].record(seconds)
+
+    def percentile(self, endpoint: str, q: float) -> Optional[float]:
+        # Not enough data to say anything useful yet
+        histogram = self._histograms.get(endpoint)
+        if histogram is None or len(histogram) < self.min_samples:
+            return None
+        return histogram.percentile(q)
+
+    def timeout(self, endpoint: str) -> float:
+        p99 = self.percentile(endpoint, 0.99)
+        if p99 is None:
+            return self.max_timeout
+        timeout = p99 * self.timeout_multiplier
+        return max(self.min_timeout, min(self.max_timeout, timeout))
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {
+            endpoint: {
+                "count": len(histogram),
+                "p50": histogram.percentile(0.5),
+                "p95": histogram.percentile(0.95),
+                "p99": histogram.percentile(0.99),
+            }
+            for endpoint, histogram in self._histograms.items()
+            if len(histogram)
+        }
@@ -0,0 +1,50 @@
+import time
+import asyncio
+from typing import Optional, Tuple
+
+from redis.asyncio import Redis
+
+
+class RateBudget:
+    # Fixed one second windows counted in Redis, so every process and node
+    # that shares the key also shares the budget
+    def __init__(
+        self,
+        redis: Redis,
+        requests_per_second: int,
+        key: str = "rate_budget",
+    ):
+        if requests_per_second < 1:
+            raise ValueError("requests_per_second must be greater than 0")
+        self._redis = redis
+        self.requests_per_second = requests_per_second
+        self.key = key
+
+    async def _take(self) -> Tuple[bool, float]:
+        # Returns whether a request may go out now, and if not how long until
+        # the next window opens
+        now = time.time()
+        window = int(now)
+        key = f"{self.key}:{window}"
+        async with self._redis.pipeline(transaction=False) as pipe:
+            await pipe.incr(key)
+            await pipe.expire(key, 2)
+            count, _ = await pipe.execute()
+        return count <= self.requests_per_second, window + 1 - now
+
+    async def try_acquire(self) -> bool:
+        allowed, _ = await self._take()
+        return allowed
+
+    async def acquire(self, timeout: Optional[float] = None) -> bool:
+        # False when no budget freed up within timeout seconds
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            allowed, wait = await self._take()
+            if allowed:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining < wait:
+                    return False
+            await asyncio.sleep(wait)
@@ -1,5 +1,8 @@
+import time
+import asyncio
+from collections import deque
 from urllib.parse import urlparse
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, Optional
 
 import aiohttp
 
@@ -15,16 +18,237 @@ from instagram_api.schema import (
     UserFollowersResponse,
 )
 from instagram_api.cache import CacheLayer
+from instagram_api.deadline import Deadline
+from instagram_api.breaker import CircuitBreaker, CircuitOpenError
+from instagram_api.latency import LatencyTracker
+from instagram_api.ratelimit import RateBudget
+
+PageCallback = Callable[[Optional[str]], Awaitable[None]]
 
 
 class InstagramAPI:
-    def __init__(self, url: str, api_key: str, redis_url: str):
+    def __init__(
+        self,
+        url: str,
+        api_key: str,
+        redis_url: str,
+        hedge: bool = True,
+        hedge_budget: float = 0.05,
+        rate_budget: Optional[RateBudget] = None,
+    ):
         self._url = url
         self._api_key = api_key
         self._host = urlparse(url).netloc
         self._cache = CacheLayer(redis_url)
+        self._latency = LatencyTracker()
+        self.hedge = hedge
+        # Fraction of requests that may be duplicated by a hedge
+        self.hedge_budget = hedge_budget
+        self._requests = 0
+        self._hedges = 0
+        # Numbers of the requests that were hedged within the last window
+        self._recent_hedges: Deque[int] = deque()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # Shared with other processes, every upstream request draws from it
+        self._rate_budget = rate_budget
+
+    @property
+    def cache(self) -> CacheLayer:
+        return self._cache
+
+    async def _fetch_json(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        headers: dict,
+        params: dict,
+        timeout: float,
+    ) -> dict:
+        async with session.get(
+            url,
+            headers=headers,
+            params=params,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as response:
+            response.raise_for_status()
+            if response.status != 200:
+                raise Exception(
+                    (
+                        f"API request failed with status code: {response.status}"
+                        f" and message: {await response.text()}"
+                    )
+                )
+            return await response.json()
+
+    def _may_hedge(self) -> bool:
+        # The budget covers the same recent window as the latency samples, a
+        # calm past must not pay for hedging every request of a slow burst
+        window = self._latency.window
+        while self._recent_hedges and self._recent_hedges[0] <= self._requests - window:
+            self._recent_hedges.popleft()
+        return len(self._recent_hedges) < self.hedge_budget * min(
+            self._requests, window
+        )
+
+    async def _hedged_fetch(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        headers: dict,
+        params: dict,
+        timeout: float,
+        record_timeout: bool = True,
+    ) -> dict:
+        endpoint = urlparse(url).path
+        started = time.monotonic()
+        self._requests += 1
+        request = self._requests
+
+        tasks = {
+            asyncio.create_task(
+                self._fetch_json(session, url, headers, params, timeout)
+            )
+        }
+        try:
+            hedge_after = self._latency.percentile(endpoint, 0.95)
+            if self.hedge and hedge_after is not None and hedge_after < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if (
+                    not done
+                    and self._may_hedge()
+                    # A hedge is a request too, but it is not worth waiting for
+                    and (
+                        self._rate_budget is None
+                        or await self._rate_budget.try_acquire()
+                    )
+                ):
+                    # The primary is in the slow tail, race a duplicate against it
+                    self._hedges += 1
+                    self._recent_hedges.append(request)
+                    tasks.add(
+                        asyncio.create_task(
+                            self._fetch_json(
+                                session, url, headers, params, timeout - hedge_after
+                            )
+                        )
+                    )
+
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self._latency.record(endpoint, time.monotonic() - started)
+                        return task.result()
+                    error = error or task.exception()
+
+            if isinstance(error, asyncio.TimeoutError) and record_timeout:
+                # Count timeouts so the adaptive timeout can grow again. One cut
+                # short by a caller's deadline says nothing about the upstream.
+                self._latency.record(endpoint, timeout)
+            raise error  # type: ignore
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _breaker(self, url: str) -> CircuitBreaker:
+        endpoint = urlparse(url).path
+        if endpoint not in self._breakers:
+            self._breakers[endpoint] = CircuitBreaker()
+        return self._breakers[endpoint]
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "requests": self._requests,
+            "hedges": self._hedges,
+            "latency": self._latency.snapshot(),
+            "breakers": {
+                endpoint: breaker.snapshot()
+                for endpoint, breaker in self._breakers.items()
+            },
+        }
+
+    async def _get_page(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        headers: dict,
+        params: dict,
+        deadline: Optional[Deadline],
+    ) -> Optional[dict]:
+        # Returns None when the deadline ran out, so callers can stop cleanly
+        if deadline is not None and deadline.expired:
+            deadline.partial = True
+            return None
+
+        breaker = self._breaker(url)
+        # Wait for the rate budget before anything is timed, so the wait is
+        # not mistaken for upstream latency. A call the breaker will reject
+        # anyway doesn't need budget.
+        if (
+            self._rate_budget is not None
+            and breaker.state != "open"
+            and not await self._rate_budget.acquire(
+                None if deadline is None else deadline.remaining()
+            )
+        ):
+            deadline.partial = True
+            return None
+
+        if not breaker.allow_request():
+            raise CircuitOpenError(urlparse(url).path, breaker.retry_after)
+        generation = breaker.generation
+
+        adaptive = self._latency.timeout(urlparse(url).path)
+        timeout = adaptive if deadline is None else min(adaptive, deadline.remaining())
+
+        started = time.monotonic()
+        recorded = False
+        try:
+            json_data = await self._hedged_fetch(
+                session,
+                url,
+                headers,
+                params,
+                timeout,
+                record_timeout=timeout >= adaptive,
+            )
+            breaker.record_success(time.monotonic() - started, generation)
+            recorded = True
+            return json_data
+        except asyncio.TimeoutError as e:
+            if deadline is not None and deadline.expired:
+                deadline.partial = True
+                return None
+            breaker.record_failure(time.monotonic() - started, generation)
+            recorded = True
+            raise Exception(f"API request timed out: {str(e)}")
+        except aiohttp.ClientResponseError as e:
+            # Only server side errors say something about the upstream's health
+            if e.status >= 500 or e.status == 429:
+                breaker.record_failure(time.monotonic() - started, generation)
+            else:
+                breaker.record_success(time.monotonic() - started, generation)
+            recorded = True
+            raise Exception(f"API request failed: {str(e)}")
+        except aiohttp.ClientError as e:
+            breaker.record_failure(time.monotonic() - started, generation)
+            recorded = True
+            raise Exception(f"API request failed: {str(e)}")
+        finally:
+            if not recorded:
+                breaker.release(generation)
 
-    async def user_info(self, handle: str) -> UserInfoResponse:
+    async def user_info(
+        self,
+        handle: str,
+        cache: bool = True,
+        deadline: Optional[Deadline] = None,
+        allow_stale: bool = True,
+    ) -> UserInfoResponse:
         headers = {
             "x-rapidapi-host": self._host,
             "x-rapidapi-key": self._api_key,
@@ -32,29 +256,43 @@ class InstagramAPI:
         querystring = {"username_or_id": handle}
         url = f"{self._url}/v1/user_info"
 
-        if user_info := await self._cache.get_account_info(handle):
+        if cache and (user_info := await self._cache.get_account_info(handle)):
             print(f"Cache hit for account info of {handle}")
             return user_info
 
         async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url,
-                headers=headers,
-                params=querystring,
-                timeout=aiohttp.ClientTimeout(total=30),
-            ) as response:
-                response.raise_for_status()
-                json_data = await response.json()
-
-                data = UserInfoResponse(**json_data)
-                if data.status == "fail":
-                    raise Exception(f"API request failed: {data.message}")
-                if data.status == "ok":
-                    await self._cache.cache_account_info(handle, data)
-                return data
+            try:
+                json_data = await self._get_page(
+                    session, url, headers, querystring, deadline
+                )
+            except CircuitOpenError:
+                # While the upstream is down, serve whatever we still have instead
+                if cache and allow_stale and (
+                    user_info := await self._cache.get_account_info(
+                        handle, allow_stale=True
+                    )
+                ):
+                    return user_info
+                raise
+            if json_data is None:
+                raise asyncio.TimeoutError(f"Deadline expired before fetching {handle}")
+
+            data = UserInfoResponse(**json_data)
+            if data.status == "fail":
+                raise Exception(f"API request failed: {data.message}")
+            if cache and data.status == "ok":
+                await self._cache.cache_account_info(handle, data)
+            return data
 
     async def user_posts(
-        self, handle: str, max_pagination: int = 1
+        self,
+        handle: str,
+        max_pagination: int = 1,
+        cache: bool = True,
+        deadline: Optional[Deadline] = None,
+        cursor: Optional[str] = None,
+        on_page: Optional[PageCallback] = None,
+        allow_stale: bool = True,
     ) -> AsyncGenerator[Post, None]:
         max_p = max_pagination
         if max_p < 1:
@@ -69,56 +307,75 @@ class InstagramAPI:
         querystring = {"username_or_id": handle}
         url = f"{self._url}/v1/user_posts"
 
-        if posts := await self._cache.get_account_posts(handle):
+        if cursor is not None:
+            # Resuming a walk, the cache only holds the pages before the cursor
+            querystring["max_id"] = cursor
+        elif cache and (posts := await self._cache.get_account_posts(handle)):
             for post in posts:
                 yield post
             return
 
+        written = False
         async with aiohttp.ClientSession() as session:
             while max_p > 0:
                 try:
-                    async with session.get(
-                        url,
-                        headers=headers,
-                        params=querystring,
-                        timeout=aiohttp.ClientTimeout(total=30),
-                    ) as response:
-                        response.raise_for_status()
-                        if response.status != 200:
-                            raise Exception(
-                                (
-                                    f"API request failed with status code: {response.status}"
-                                    f" and message: {await response.text()}"
-                                )
-                            )
-                        json_data = await response.json()
-
-                        data = UserPostsResponse(**json_data)
-                        if data.status == "fail":
-                            raise Exception(f"API request failed: {data.message}")
-                        if data.data.next_max_id:
-                            # type: ignore
-                            querystring["max_id"] = data.data.next_max_id
-                        else:
-                            querystring.pop("max_id", None)
-
-                        for post in data.fast:
-                            await self._cache.cache_account_post(handle, post)
-                            yield post
-                        max_p -= 1
-                except aiohttp.ClientError as e:
-                    raise Exception(f"API request failed: {str(e)}")
+                    json_data = await self._get_page(
+                        session, url, headers, querystring, deadline
+                    )
+                except CircuitOpenError:
+                    # While the upstream is down, serve whatever we still have instead
+                    if (
+                        not (cache and allow_stale)
+                        or cursor is not None
+                        or max_p < max_pagination
+                    ):
+                        raise
+                    posts = await self._cache.get_account_posts(
+                        handle, allow_stale=True
+                    )
+                    if not posts:
+                        raise
+                    for post in posts:
+                        yield post
+                    return
+                if json_data is None:
+                    # The deadline cut the walk short, what we cached is incomplete
+                    if written:
+                        await self._cache.mark_stale(f"posts:{handle}")
+                    return
+                try:
+                    data = UserPostsResponse(**json_data)
                 except ValueError as e:
                     raise Exception(f"Invalid response data: {str(e)}")
-                except Exception as e:
-                    raise Exception(f"An unexpected error occurred: {str(e)}")
-                finally:
-                    await session.close()
+                if data.status == "fail":
+                    raise Exception(f"API request failed: {data.message}")
+
+                if cache:
+                    await self._cache.cache_account_posts(
+                        handle,
+                        data.fast,
+                        replace=max_p == max_pagination and cursor is None,
+                    )
+                    written = True
+                for post in data.fast:
+                    yield post
+
+                max_p -= 1
+                if on_page is not None:
+                    await on_page(data.data.next_max_id)
+                if not data.data.next_max_id:
+                    break
+                querystring["max_id"] = data.data.next_max_id
 
     async def user_followers(
         self,
         handle: str,
         max_pagination: int = 1,
+        cache: bool = True,
+        deadline: Optional[Deadline] = None,
+        cursor: Optional[str] = None,
+        on_page: Optional[PageCallback] = None,
+        allow_stale: bool = True,
     ) -> AsyncGenerator[Follower, None]:
         max_p = max_pagination
         if max_p < 1:
@@ -133,60 +390,77 @@ class InstagramAPI:
         querystring = {"username_or_id": handle}
         url = f"{self._url}/v1/user_followers_adv"
 
-        if followers := await self._cache.get_account_followers(handle):
+        if cursor is not None:
+            # Resuming a walk, the cache only holds the pages before the cursor
+            querystring["end_cursor"] = cursor
+        elif cache and (followers := await self._cache.get_account_followers(handle)):
             for follower in followers:
                 yield follower
             return
 
+        written = False
         async with aiohttp.ClientSession() as session:
             while max_p > 0:
                 try:
-                    async with session.get(
-                        url,
-                        headers=headers,
-                        params=querystring,
-                        timeout=aiohttp.ClientTimeout(total=30),
-                    ) as response:
-                        response.raise_for_status()
-                        if response.status != 200:
-                            raise Exception(
-                                (
-                                    f"API request failed with status code: {response.status}"
-                                    f" and message: {await response.text()}"
-                                )
-                            )
-                        json_data = await response.json()
-
-                        data = UserFollowersResponse(**json_data)
-                        if data.status == "fail":
-                            raise Exception(f"API request failed: {data.message}")
-                        if data.data.edge_followed_by.page_info.has_next_page:
-                            pagination_token = (
-                                data.data.edge_followed_by.page_info.end_cursor
-                            )
-                            # type: ignore
-                            querystring["end_cursor"] = pagination_token  # type: ignore
-                        else:
-                            querystring.pop("end_cursor", None)
-
-                        for follower in data.fast:
-                            await self._cache.cache_account_follower(handle, follower)
-                            yield follower
-                        max_pagination -= 1
-
-                except aiohttp.ClientError as e:
-                    raise Exception(f"API request failed: {str(e)}")
+                    json_data = await self._get_page(
+                        session, url, headers, querystring, deadline
+                    )
+                except CircuitOpenError:
+                    # While the upstream is down, serve whatever we still have instead
+                    if (
+                        not (cache and allow_stale)
+                        or cursor is not None
+                        or max_p < max_pagination
+                    ):
+                        raise
+                    followers = await self._cache.get_account_followers(
+                        handle, allow_stale=True
+                    )
+                    if not followers:
+                        raise
+                    for follower in followers:
+                        yield follower
+                    return
+                if json_data is None:
+                    # The deadline cut the walk short, what we cached is incomplete
+                    if written:
+                        await self._cache.mark_stale(f"followers:{handle}")
+                    return
+                try:
+                    data = UserFollowersResponse(**json_data)
                 except ValueError as e:
                     raise Exception(f"Invalid response data: {str(e)}")
-                except Exception as e:
-                    raise Exception(f"An unexpected error occurred: {str(e)}")
-                finally:
-                    await session.close()
+                if data.status == "fail":
+                    raise Exception(f"API request failed: {data.message}")
+
+                if cache:
+                    await self._cache.cache_account_followers(
+                        handle,
+                        data.fast,
+                        replace=max_p == max_pagination and cursor is None,
+                    )
+                    written = True
+                for follower in data.fast:
+                    yield follower
+
+                max_p -= 1
+                page_info = data.data.edge_followed_by.page_info
+                next_cursor = page_info.end_cursor if page_info.has_next_page else None
+                if on_page is not None:
+                    await on_page(next_cursor)
+                if not next_cursor:
+                    break
+                querystring["end_cursor"] = next_cursor
 
     async def media_comments(
         self,
         media_id: str,
         max_pagination: int = 1,
+        cache: bool = True,
+        deadline: Optional[Deadline] = None,
+        cursor: Optional[str] = None,
+        on_page: Optional[PageCallback] = None,
+        allow_stale: bool = True,
     ) -> AsyncGenerator[Comment, None]:
         max_p = max_pagination
 
@@ -204,55 +478,73 @@ class InstagramAPI:
         }
 
         url = f"{self._url}/v1/media_comments"
-        if comments := await self._cache.get_media_comments(media_id):
+        if cursor is not None:
+            # Resuming a walk, the cache only holds the pages before the cursor
+            querystring["min_id"] = cursor
+        elif cache and (comments := await self._cache.get_media_comments(media_id)):
             for comment in comments:
                 yield comment
             return
+
+        written = False
         async with aiohttp.ClientSession() as session:
             while max_p > 0:
                 try:
-                    async with session.get(
-                        url,
-                        headers=headers,
-                        params=querystring,
-                        timeout=aiohttp.ClientTimeout(total=30),
-                    ) as response:
-                        response.raise_for_status()
-                        if response.status != 200:
-                            raise Exception(
-                                (
-                                    f"API request failed with status code: {response.status}"
-                                    f" and message: {await response.text()}"
-                                )
-                            )
-                        json_data = await response.json()
-
-                        data = MediaCommentsResponse(**json_data)
-                        if data.status == "fail":
-                            raise Exception(f"API request failed: {data.message}")
-                        if data.data.next_min_id:
-                            # type: ignore
-                            querystring["min_id"] = data.data.next_min_id
-                        else:
-                            querystring.pop("min_id", None)
-
-                        for comment in data.fast:
-                            await self._cache.cache_media_comment(media_id, comment)
-                            yield comment
-                        max_p -= 1
-                except aiohttp.ClientError as e:
-                    raise Exception(f"API request failed: {str(e)}")
+                    json_data = await self._get_page(
+                        session, url, headers, querystring, deadline
+                    )
+                except CircuitOpenError:
+                    # While the upstream is down, serve whatever we still have instead
+                    if (
+                        not (cache and allow_stale)
+                        or cursor is not None
+                        or max_p < max_pagination
+                    ):
+                        raise
+                    comments = await self._cache.get_media_comments(
+                        media_id, allow_stale=True
+                    )
+                    if not comments:
+                        raise
+                    for comment in comments:
+                        yield comment
+                    return
+                if json_data is None:
+                    # The deadline cut the walk short, what we cached is incomplete
+                    if written:
+                        await self._cache.mark_stale(f"comments:{media_id}")
+                    return
+                try:
+                    data = MediaCommentsResponse(**json_data)
                 except ValueError as e:
                     raise Exception(f"Invalid response data: {str(e)}")
-                except Exception as e:
-                    raise Exception(f"An unexpected error occurred: {str(e)}")
-                finally:
-                    await session.close()
+                if data.status == "fail":
+                    raise Exception(f"API request failed: {data.message}")
+
+                if cache:
+                    await self._cache.cache_media_comments(
+                        media_id,
+                        data.fast,
+                        replace=max_p == max_pagination and cursor is None,
+                    )
+                    written = True
+                for comment in data.fast:
+                    yield comment
+
+                max_p -= 1
+                if on_page is not None:
+                    await on_page(data.data.next_min_id)
+                if not data.data.next_min_id:
+                    break
+                querystring["min_id"] = data.data.next_min_id
 
     async def media_likes(
         self,
         media_id: str,
         max_pagination: int = 1,
+        cache: bool = True,
+        deadline: Optional[Deadline] = None,
+        allow_stale: bool = True,
     ) -> AsyncGenerator[LikesUser, None]:
         max_p = max_pagination
 
@@ -270,42 +562,38 @@ class InstagramAPI:
         }
 
         url = f"{self._url}/v1/media_likes"
-        if likes := await self._cache.get_media_likes(media_id):
+        if cache and (likes := await self._cache.get_media_likes(media_id)):
             for like in likes:
                 yield like
             return
+
         async with aiohttp.ClientSession() as session:
-            while max_p > 0:
-                try:
-                    async with session.get(
-                        url,
-                        headers=headers,
-                        params=querystring,
-                        timeout=aiohttp.ClientTimeout(total=30),
-                    ) as response:
-                        response.raise_for_status()
-                        if response.status != 200:
-                            raise Exception(
-                                (
-                                    f"API request failed with status code: {response.status}"
-                                    f" and message: {await response.text()}"
-                                )
-                            )
-                        json_data = await response.json()
-
-                        data = MediaLikesResponse(**json_data)
-                        if data.status == "fail":
-                            raise Exception(f"API request failed: {data.message}")
-
-                        for like in data.fast:
-                            await self._cache.cache_media_like(media_id, like)
-                            yield like
-                        max_p -= 1
-                except aiohttp.ClientError as e:
-                    raise Exception(f"API request failed: {str(e)}")
-                except ValueError as e:
-                    raise Exception(f"Invalid response data: {str(e)}")
-                except Exception as e:
-                    raise Exception(f"An unexpected error occurred: {str(e)}")
-                finally:
-                    await session.close()
+            try:
+                json_data = await self._get_page(
+                    session, url, headers, querystring, deadline
+                )
+            except CircuitOpenError:
+                # While the upstream is down, serve whatever we still have instead
+                if not (cache and allow_stale) or not (
+                    likes := await self._cache.get_media_likes(
+                        media_id, allow_stale=True
+                    )
+                ):
+                    raise
+                for like in likes:
+                    yield like
+                return
+            if json_data is None:
+                return
+            try:
+                data = MediaLikesResponse(**json_data)
+            except ValueError as e:
+                raise Exception(f"Invalid response data: {str(e)}")
+            if data.status == "fail":
+                raise Exception(f"API request failed: {data.message}")
+
+            # The likes endpoint is not paginated, every request returns the same page
+            if cache:
+                await self._cache.cache_media_likes(media_id, data.fast, replace=True)
+            for like in data.fast:
+                yield like
@@ -85,3 +85,17 @@ class InstagramPost(BaseModel):
     text: str
     image_url: str
     hashtags: List[str]
+
+
+class AccountMetrics(BaseModel):
+    handle: str
+    posts_analyzed: int
+    avg_likes: float
+    avg_comments: float
+    avg_reshares: float
+    engagement_rate: float
+    engagement_percentile: float
+    posts_per_week: float
+    followers_analyzed: int
+    private_follower_ratio: float
+    verified_follower_ratio: float
@@ -0,0 +1,139 @@
+import re
+import time
+import uuid
+from typing import List, Optional, Sequence, Tuple
+
+from redis.asyncio import Redis
+
+from instagram_api.schema import Post
+
+
+DAY = 24 * 3600
+
+HASHTAG_RE = re.compile(r"#(\w+)")
+MENTION_RE = re.compile(r"(?<![\w.])@([A-Za-z0-9_](?:[A-Za-z0-9_.]*[A-Za-z0-9_])?)")
+
+
+def extract_hashtags(text: str) -> List[str]:
+    return list(dict.fromkeys(tag.lower() for tag in HASHTAG_RE.findall(text)))
+
+
+def extract_mentions(text: str) -> List[str]:
+    return list(dict.fromkeys(name.lower() for name in MENTION_RE.findall(text)))
+
+
+class TagIndex:
+    # Every tag and mention gets a sorted set of post ids scored by taken_at,
+    # so lookups by time are range reads instead of scanning cached captions
+    def __init__(self, redis: Redis, retention: int = 30 * 24 * 3600):
+        self._redis = redis
+        self.retention = retention
+
+    async def add_posts(self, posts: Sequence[Post]):
+        cutoff = int(time.time()) - self.retention
+        keys: List[Tuple[str, str, int]] = []
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for post in posts:
+                if post.taken_at < cutoff:
+                    continue
+                text = post.caption.text
+                for counter, name in [
+                    *[("hashtag", tag) for tag in extract_hashtags(text)],
+                    *[("mention", user) for user in extract_mentions(text)],
+                ]:
+                    key = f"{counter}:{name}"
+                    await pipe.zadd(key, {post.id: post.taken_at})
+                    await pipe.zremrangebyscore(key, "-inf", f"({cutoff}")
+                    await pipe.expire(key, self.retention)
+                    keys.append((counter, name, post.taken_at // DAY))
+            if not keys:
+                return
+            results = await pipe.execute()
+
+        # Only count posts the index has not seen before, so refreshing the
+        # cache doesn't inflate the totals. Counts are bucketed by the day the
+        # post was taken and expire with the posts they count.
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for (counter, name, day), added in zip(keys, results[::3]):
+                if added:
+                    key = f"{counter}_counts:{day}"
+                    await pipe.zincrby(key, 1, name)
+                    await pipe.expireat(key, (day + 1) * DAY + self.retention)
+            await pipe.execute()
+
+    async def _posts(
+        self,
+        key: str,
+        limit: int,
+        since: Optional[int],
+        until: Optional[int],
+    ) -> List[Tuple[str, int]]:
+        posts = await self._redis.zrevrangebyscore(
+            key,
+            "+inf" if until is None else until,
+            "-inf" if since is None else since,
+            start=0,
+            num=limit,
+            withscores=True,
+        )
+        return [(post_id.decode(), int(taken_at)) for post_id, taken_at in posts]
+
+    async def posts_with_hashtag(
+        self,
+        tag: str,
+        limit: int = 50,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+    ) -> List[Tuple[str, int]]:
+        tag = tag.lstrip("#").lower()
+        return await self._posts(f"hashtag:{tag}", limit, since, until)
+
+    async def posts_mentioning(
+        self,
+        username: str,
+        limit: int = 50,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+    ) -> List[Tuple[str, int]]:
+        username = username.lstrip("@").lower()
+        return await self._posts(f"mention:{username}", limit, since, until)
+
+    async def _top(
+        self,
+        counter: str,
+        top_n: int,
+        since: Optional[int],
+        until: Optional[int],
+    ) -> List[Tuple[str, int]]:
+        # Whole days are summed, so since and until are rounded out to days
+        now = int(time.time())
+        since = max(now - self.retention, since or 0)
+        until = now if until is None else until
+        if since > until:
+            return []
+        days = [
+            f"{counter}_counts:{day}" for day in range(since // DAY, until // DAY + 1)
+        ]
+        key = f"{counter}_counts:top:{uuid.uuid4().hex}"
+        async with self._redis.pipeline() as pipe:
+            await pipe.zunionstore(key, days)
+            await pipe.zrevrange(key, 0, top_n - 1, withscores=True)
+            await pipe.delete(key)
+            _, top, _ = await pipe.execute()
+        return [(name.decode(), int(count)) for name, count in top]
+
+    async def top_hashtags(
+        self,
+        top_n: int = 10,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+    ) -> List[Tuple[str, int]]:
+        return await self._top("hashtag", top_n, since, until)
+
+    async def top_mentions(
+        self,
+        top_n: int = 10,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+    ) -> List[Tuple[str, int]]:
+        return await self._top("mention", top_n, since, until)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from typing import Optional
+
+from instagram_api.routes import InstagramAPI
+
+
+logger = logging.getLogger(__package__)
+
+MAX_PAGINATION = 10
+
+
+class CacheWarmer:
+    def __init__(
+        self,
+        api: InstagramAPI,
+        top_n: int = 100,
+        refresh_before: int = 300,
+        interval: int = 60,
+        requests_per_minute: int = 60,
+        budget_share: float = 0.1,
+        max_pagination: int = 1,
+        decay_factor: float = 0.5,
+    ):
+        if not 0 < budget_share <= 1:
+            raise ValueError("budget_share must be between 0 and 1")
+
+        self._api = api
+        self._cache = api.cache
+        self.top_n = top_n
+        self.refresh_before = refresh_before
+        self.interval = interval
+        self.max_pagination = max_pagination
+        self.decay_factor = decay_factor
+        # Only spend budget_share of the rate limit on refreshes
+        self._min_spacing = 60 / (requests_per_minute * budget_share)
+        self._task: Optional[asyncio.Task] = None
+
+    async def _pace(self, next_cursor: Optional[str]):
+        # Space out every upstream request, not just every key
+        if next_cursor:
+            await asyncio.sleep(self._min_spacing)
+
+    async def refresh(self, key: str):
+        kind, _, ident = key.partition(":")
+        # Refresh to the depth that was cached, a one page refresh of a deep
+        # list would otherwise replace it with a truncated one
+        depth = min(
+            MAX_PAGINATION,
+            max(self.max_pagination, await self._cache.cached_pages(key)),
+        )
+        pages = 0
+
+        async def on_page(next_cursor: Optional[str]):
+            nonlocal pages
+            pages += 1
+            await self._pace(next_cursor)
+
+        if kind == "account_info":
+            info = await self._api.user_info(ident, cache=False)
+            if info.status == "ok":
+                await self._cache.cache_account_info(ident, info)
+        elif kind == "posts":
+            posts = [
+                p
+                async for p in self._api.user_posts(
+                    ident, depth, cache=False, on_page=on_page
+                )
+            ]
+            await self._cache.cache_account_posts(
+                ident, posts, replace=True, pages=pages
+            )
+        elif kind == "followers":
+            followers = [
+                f
+                async for f in self._api.user_followers(
+                    ident, depth, cache=False, on_page=on_page
+                )
+            ]
+            await self._cache.cache_account_followers(
+                ident, followers, replace=True, pages=pages
+            )
+        elif kind == "comments":
+            comments = [
+                c
+                async for c in self._api.media_comments(
+                    ident, depth, cache=False, on_page=on_page
+                )
+            ]
+            await self._cache.cache_media_comments(
+                ident, comments, replace=True, pages=pages
+            )
+        elif kind == "likes":
+            likes = [lk async for lk in self._api.media_likes(ident, cache=False)]
+            await self._cache.cache_media_likes(ident, likes, replace=True)
+        else:
+            logger.warning(f"Don't know how to refresh cache key {key}")
+
+    async def warm_once(self) -> int:
+        refreshed = 0
+        for key, _ in await self._cache.hot_keys(self.top_n):
+            ttl = await self._cache.fresh_ttl(key)
+            # -2 means the entry is gone and there is nothing to keep warm, -1
+            # means no expiry, anything above the window is still fresh
+            if ttl in (-2, -1) or ttl > self.refresh_before:
+                continue
+            try:
+                await self.refresh(key)
+                refreshed += 1
+            except Exception as e:
+                logger.warning(f"Failed to refresh cache key {key}: {str(e)}")
+            await asyncio.sleep(self._min_spacing)
+        await self._cache.decay_access_counts(self.decay_factor)
+        return refreshed
+
+    async def run(self):
+        while True:
+            refreshed = await self.warm_once()
+            logger.debug(f"Cache warmer refreshed {refreshed} keys")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -0,0 +1,54 @@
+import fakeredis
+import pytest
+
+from instagram_api import cache as cache_module
+from instagram_api.cache import CacheLayer
+from instagram_api.schema import Post, Follower
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.aioredis.FakeRedis()
+
+
+@pytest.fixture
+def cache(monkeypatch, redis) -> CacheLayer:
+    monkeypatch.setattr(cache_module.Redis, "from_url", lambda url: redis)
+    return CacheLayer("redis://localhost")
+
+
+def make_post(i: int, text: str = "", taken_at: int = 1_700_000_000) -> Post:
+    return Post(
+        id=str(i),
+        pk=str(i),
+        code=f"code{i}",
+        taken_at=taken_at + i,
+        like_count=i,
+        media_type=1,
+        comment_count=1,
+        reshare_count=0,
+        caption={"text": text},
+        user={
+            "id": "1",
+            "pk": "1",
+            "pk_id": "1",
+            "username": "someone",
+            "full_name": "Someone",
+            "is_private": False,
+            "is_verified": False,
+            "profile_pic_url": "https://example.com/pic.jpg",
+        },
+    )
+
+
+def make_follower(i: int, is_private: bool = False) -> Follower:
+    return Follower(
+        id=str(i),
+        username=f"follower{i}",
+        full_name=f"Follower {i}",
+        is_private=is_private,
+        is_verified=False,
+        profile_pic_url="https://example.com/pic.jpg",
+        followed_by_viewer=False,
+        requested_by_viewer=False,
+    )
@@ -0,0 +1,186 @@
+import asyncio
+
+import pytest
+
+from instagram_api.analytics import (
+    account_metrics,
+    analyze_accounts,
+    followers_analysis,
+    instagram_info,
+    posts_response,
+)
+from instagram_api.schema import Post, UserInfoResponse
+
+from conftest import make_post, make_follower
+
+
+T = 1_700_000_000
+DAY = 24 * 3600
+
+
+def make_info(handle: str, follower_count: int) -> UserInfoResponse:
+    picture = {"height": 150, "width": 150, "url": "https://example.com/pic.jpg"}
+    return UserInfoResponse(
+        status="ok",
+        message=None,
+        data={
+            "pk": "1",
+            "id": "1",
+            "fbid_v2": "1",
+            "username": handle,
+            "full_name": handle.title(),
+            "biography": f"About {handle}",
+            "category": "",
+            "is_business": True,
+            "public_email": "",
+            "public_phone_number": "",
+            "contact_phone_number": "",
+            "city_name": "",
+            "bio_links": [],
+            "media_count": 12,
+            "follower_count": follower_count,
+            "following_count": 34,
+            "profile_pic_url": picture["url"],
+            "hd_profile_pic_url_info": picture,
+            "hd_profile_pic_versions": [picture],
+        },
+    )
+
+
+def post(i: int, likes: int, comments: int, reshares: int, taken_at: int) -> Post:
+    return make_post(i).model_copy(
+        update={
+            "like_count": likes,
+            "comment_count": comments,
+            "reshare_count": reshares,
+            "taken_at": taken_at,
+        }
+    )
+
+
+def test_account_metrics():
+    infos = [
+        make_info("a", 100),
+        make_info("b", 1000),
+        make_info("c", 50),
+        make_info("d", 0),
+    ]
+    posts = [
+        # (11 + 22 + 36) / 3 = 23 per post, three posts over one week
+        [
+            post(1, 10, 1, 0, T),
+            post(2, 20, 2, 0, T + 3 * DAY),
+            post(3, 30, 3, 3, T + 7 * DAY),
+        ],
+        [post(4, 5, 5, 0, T)],
+        [],
+        [post(5, 7, 0, 0, T)],
+    ]
+    verified = make_follower(3).model_copy(update={"is_verified": True})
+    followers = [
+        [make_follower(1), make_follower(2, is_private=True), verified],
+        [],
+        [make_follower(4, is_private=True)],
+        [],
+    ]
+
+    metrics = account_metrics(["a", "b", "c", "d"], infos, posts, followers)
+    a, b, c, d = metrics
+    assert [m.handle for m in metrics] == ["a", "b", "c", "d"]
+    assert [m.posts_analyzed for m in metrics] == [3, 1, 0, 1]
+
+    assert (a.avg_likes, a.avg_comments, a.avg_reshares) == (20, 2, 1)
+    assert a.engagement_rate == pytest.approx(0.23)
+    assert a.posts_per_week == pytest.approx(2)
+    assert b.engagement_rate == pytest.approx(0.01)
+    # One post has no cadence, no posts or no followers have no engagement
+    assert b.posts_per_week == 0
+    assert (c.avg_likes, c.engagement_rate, c.posts_per_week) == (0, 0, 0)
+    assert (d.avg_likes, d.engagement_rate) == (7, 0)
+    # Share of the other three accounts with a lower rate
+    assert [m.engagement_percentile for m in metrics] == pytest.approx([1, 2 / 3, 0, 0])
+
+    assert [m.followers_analyzed for m in metrics] == [3, 0, 1, 0]
+    assert a.private_follower_ratio == pytest.approx(1 / 3)
+    assert a.verified_follower_ratio == pytest.approx(1 / 3)
+    assert (c.private_follower_ratio, c.verified_follower_ratio) == (1, 0)
+    assert b.private_follower_ratio == 0
+
+
+def test_account_metrics_single_account():
+    (metrics,) = account_metrics(["a"], [None], [[post(1, 10, 0, 0, T)]], [[]])
+    # Without an info there is no follower count to divide by
+    assert metrics.avg_likes == 10
+    assert metrics.engagement_rate == 0
+    assert metrics.engagement_percentile == 0
+
+
+def test_analyze_accounts_reads_in_chunks_without_tracking(cache):
+    async def run():
+        await cache.cache_account_posts("a", [make_post(1), make_post(2)])
+        await cache.cache_account_posts("b", [make_post(3)])
+        await cache.mark_stale("posts:b")
+        await cache.cache_account_followers(
+            "b", [make_follower(1, is_private=True), make_follower(2)]
+        )
+        await cache.cache_account_posts("d", [make_post(4)])
+        return await analyze_accounts(cache, ["a", "b", "c", "d"], chunk_size=2)
+
+    metrics = asyncio.run(run())
+    assert [m.handle for m in metrics] == ["a", "b", "c", "d"]
+    assert [m.posts_analyzed for m in metrics] == [2, 1, 0, 1]
+    assert [m.followers_analyzed for m in metrics] == [0, 2, 0, 0]
+    assert metrics[1].private_follower_ratio == 0.5
+    assert asyncio.run(cache.hot_keys(10)) == []
+
+
+def test_instagram_info():
+    info = instagram_info(make_info("someone", 100))
+    assert info.model_dump() == {
+        "title": "Someone",
+        "handle": "someone",
+        "bio": "About someone",
+        "is_business": True,
+        "followers_count": 100,
+        "following_count": 34,
+        "posts_count": 12,
+    }
+
+
+def test_posts_response():
+    image = {"url": "https://example.com/1.jpg", "width": 1080, "height": 1080}
+    with_image = Post.model_validate(
+        {
+            **make_post(1, text="Sunset #Beach #sky #beach").model_dump(),
+            "image_versions2": {"candidates": [image]},
+        }
+    )
+    response = posts_response([with_image, make_post(2, text="no tags")])
+    assert [p.model_dump() for p in response.posts] == [
+        {
+            "id": "1",
+            "text": "Sunset #Beach #sky #beach",
+            "image_url": "https://example.com/1.jpg",
+            "hashtags": ["beach", "sky"],
+        },
+        {"id": "2", "text": "no tags", "image_url": "", "hashtags": []},
+    ]
+
+
+def test_followers_analysis():
+    verified = make_follower(3, is_private=True).model_copy(
+        update={"is_verified": True}
+    )
+    followers = [make_follower(1), make_follower(2, is_private=True), verified]
+    analysis = followers_analysis(make_info("someone", 3), followers)
+    assert analysis.account.handle == "someone"
+    groups = {
+        name: [f.id for f in group] for name, group in analysis.interest_groups.items()
+    }
+    # Verified wins over private
+    assert groups == {"verified": ["3"], "public": ["1"], "private": ["2"]}
+
+
+def test_followers_analysis_without_followers():
+    analysis = followers_analysis(make_info("someone", 0), [])
+    assert analysis.interest_groups == {"verified": [], "public": [], "private": []}
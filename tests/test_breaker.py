@@ -0,0 +1,146 @@
+import pytest
+
+from instagram_api import breaker as breaker_module
+from instagram_api.breaker import CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(breaker_module.time, "monotonic", clock)
+    return clock
+
+
+def make_breaker(**kwargs) -> CircuitBreaker:
+    options = dict(window=10, min_calls=4, open_duration=30.0)
+    options.update(kwargs)
+    return CircuitBreaker(**options)
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure(0.1)
+    assert breaker.state == "closed"
+    assert breaker.allow_request()
+
+
+def test_opens_on_error_rate(clock):
+    breaker = make_breaker()
+    breaker.record_success(0.1)
+    breaker.record_success(0.1)
+    breaker.record_failure(0.1)
+    assert breaker.state == "closed"
+    breaker.record_failure(0.1)
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+    assert breaker.retry_after == 30.0
+    assert breaker.times_opened == 1
+
+
+def test_opens_on_slow_calls(clock):
+    breaker = make_breaker(slow_call_duration=1.0, slow_call_threshold=0.75)
+    breaker.record_success(0.1)
+    for _ in range(3):
+        breaker.record_success(2.0)
+    assert breaker.state == "open"
+
+
+def test_half_open_after_open_duration(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    clock.now += 29.0
+    assert breaker.state == "open"
+    assert breaker.retry_after == pytest.approx(1.0)
+    clock.now += 1.0
+    assert breaker.state == "half_open"
+    assert breaker.retry_after == 0.0
+
+
+def test_half_open_allows_limited_trial_calls(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    clock.now += 30.0
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.release()
+    assert breaker.allow_request()
+
+
+def test_half_open_success_closes(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    clock.now += 30.0
+    assert breaker.allow_request()
+    breaker.record_success(0.1)
+    assert breaker.state == "closed"
+    assert breaker.error_rate == 0.0
+
+
+@pytest.mark.parametrize("failed, latency", [(True, 0.1), (False, 20.0)])
+def test_half_open_failure_or_slow_call_reopens(clock, failed, latency):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    clock.now += 30.0
+    assert breaker.allow_request()
+    if failed:
+        breaker.record_failure(latency)
+    else:
+        breaker.record_success(latency)
+    assert breaker.state == "open"
+    assert breaker.times_opened == 2
+    assert breaker.retry_after == 30.0
+
+
+def test_results_while_open_are_ignored(clock):
+    breaker = make_breaker()
+    generation = breaker.generation
+    for _ in range(4):
+        breaker.record_failure(0.1, generation)
+    assert breaker.state == "open"
+
+    # Requests that were already in flight when it opened fail late
+    clock.now += 10
+    for _ in range(5):
+        breaker.record_failure(0.1, generation)
+    breaker.record_failure(0.1)
+    assert breaker.times_opened == 1
+    assert breaker.retry_after == pytest.approx(20.0)
+    clock.now += 20
+    assert breaker.state == "half_open"
+
+
+def test_only_the_trial_call_decides_half_open(clock):
+    breaker = make_breaker()
+    closed = breaker.generation
+    for _ in range(4):
+        breaker.record_failure(0.1, closed)
+    clock.now += 30
+
+    assert breaker.allow_request()
+    trial = breaker.generation
+    assert trial != closed
+
+    # A late result from before the breaker opened changes nothing
+    breaker.record_success(0.1, closed)
+    assert breaker.state == "half_open"
+    breaker.record_failure(0.1, closed)
+    assert breaker.state == "half_open"
+    breaker.release(closed)
+    assert not breaker.allow_request()
+
+    breaker.record_success(0.1, trial)
+    assert breaker.state == "closed"
+    assert breaker.times_opened == 1
@@ -0,0 +1,74 @@
+import asyncio
+
+from instagram_api.cache import CacheLayer
+
+from conftest import make_post
+
+
+def test_only_hits_are_counted(cache):
+    async def run():
+        await cache.cache_account_posts("someone", [make_post(0)])
+        await cache.get_account_posts("someone")
+        await cache.get_account_posts("someone")
+        assert await cache.get_account_posts("nobody") is None
+        assert await cache.get_account_info("nobody") is None
+        return await cache.hot_keys(10)
+
+    assert asyncio.run(run()) == [("posts:someone", 2.0)]
+
+
+def test_stale_entries_are_counted(cache):
+    async def run():
+        await cache.cache_account_posts("someone", [make_post(0)])
+        await cache.mark_stale("posts:someone")
+        assert await cache.get_account_posts("someone") is None
+        return await cache.hot_keys(10)
+
+    # Still wanted, so still worth warming
+    assert asyncio.run(run()) == [("posts:someone", 1.0)]
+
+
+def test_tracked_keys_are_capped(monkeypatch, redis):
+    monkeypatch.setattr("instagram_api.cache.Redis.from_url", lambda url: redis)
+    cache = CacheLayer("redis://localhost", max_tracked_keys=2)
+
+    async def run():
+        for handle in ["a", "b", "c"]:
+            await cache.cache_account_posts(handle, [make_post(0)])
+        for handle in ["a", "a", "b", "b", "c"]:
+            await cache.get_account_posts(handle)
+        return await cache.hot_keys(10)
+
+    assert asyncio.run(run()) == [("posts:b", 2.0), ("posts:c", 1.0)]
+
+
+def test_untracked_reads(monkeypatch, redis):
+    monkeypatch.setattr("instagram_api.cache.Redis.from_url", lambda url: redis)
+    cache = CacheLayer("redis://localhost", track_access=False)
+
+    async def run():
+        await cache.cache_account_posts("someone", [make_post(0)])
+        posts = await cache.get_account_posts("someone")
+        return posts, await cache.hot_keys(10)
+
+    posts, hot = asyncio.run(run())
+    assert [post.id for post in posts] == ["0"]
+    assert hot == []
+
+
+def test_mark_stale_only_shortens_ttl(cache, redis):
+    async def run():
+        await cache.cache_account_posts("fresh", [make_post(0)])
+        await cache.cache_account_posts("stale", [make_post(0)])
+        await redis.expire("posts:stale", 5)
+        await cache.mark_stale("posts:fresh")
+        await cache.mark_stale("posts:stale")
+        return (
+            await redis.ttl("posts:fresh"),
+            await redis.ttl("pages:posts:fresh"),
+            await redis.ttl("posts:stale"),
+        )
+
+    fresh, pages, stale = asyncio.run(run())
+    assert fresh == pages == cache.stale_duration
+    assert stale <= 5
@@ -0,0 +1,117 @@
+import json
+import asyncio
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from instagram_api.export import (
+    arrow_schema,
+    export_arrow,
+    export_ndjson,
+    export_parquet,
+    flatten_record,
+    flatten_schema,
+)
+from instagram_api.schema import Post
+
+from conftest import make_post
+
+
+async def records(posts):
+    for post in posts:
+        yield post
+
+
+def test_flatten_schema_for_post():
+    names = [name for name, _ in flatten_schema(Post)]
+    assert "caption.text" in names
+    assert "user.username" in names
+    assert "user.is_verified" in names
+    assert "media" in names
+    assert "caption" not in names
+    assert "user" not in names
+    assert not any(name.startswith("image_versions2") for name in names)
+    assert not any(name.startswith("carousel_media") for name in names)
+
+
+def test_flatten_record_for_post():
+    post = Post.model_validate(
+        {
+            **make_post(1, text="hello").model_dump(),
+            "image_versions2": {
+                "candidates": [
+                    {"url": "https://example.com/1.jpg", "width": 1, "height": 2}
+                ]
+            },
+        }
+    )
+    row = flatten_record(post, flatten_schema(Post))
+    assert row["id"] == "1"
+    assert row["caption.text"] == "hello"
+    assert row["user.username"] == "someone"
+    assert row["media"] == [
+        {"url": "https://example.com/1.jpg", "width": 1, "height": 2, "type": "image"}
+    ]
+
+
+def test_arrow_schema_types():
+    schema = arrow_schema(Post)
+    assert schema.field("like_count").type == pa.int64()
+    assert schema.field("user.is_private").type == pa.bool_()
+    assert schema.field("caption.text").type == pa.string()
+    media = schema.field("media").type
+    assert pa.types.is_list(media)
+    assert media.value_type.field("width").type == pa.int64()
+
+
+def test_ndjson_round_trip(tmp_path):
+    path = tmp_path / "posts.ndjson"
+    posts = [make_post(i, text=f"caption {i}") for i in range(5)]
+    count = asyncio.run(export_ndjson(records(posts), str(path), batch_size=2))
+
+    rows = [json.loads(line) for line in path.read_text().splitlines()]
+    assert count == 5
+    assert rows == [flatten_record(post, flatten_schema(Post)) for post in posts]
+
+
+def test_parquet_row_groups(tmp_path):
+    path = tmp_path / "posts.parquet"
+    posts = [make_post(i, text=f"caption {i}") for i in range(25)]
+    count = asyncio.run(export_parquet(records(posts), str(path), row_group_size=10))
+
+    parquet = pq.ParquetFile(path)
+    assert count == 25
+    assert parquet.metadata.num_row_groups == 3
+    assert [parquet.metadata.row_group(i).num_rows for i in range(3)] == [10, 10, 5]
+    table = parquet.read()
+    assert table.column("id").to_pylist() == [str(i) for i in range(25)]
+    assert table.column("caption.text").to_pylist()[3] == "caption 3"
+
+
+def test_arrow_file(tmp_path):
+    path = tmp_path / "posts.arrow"
+    posts = [make_post(i) for i in range(3)]
+    count = asyncio.run(export_arrow(records(posts), str(path), batch_size=2))
+
+    with pa.ipc.open_file(path) as reader:
+        assert reader.num_record_batches == 2
+        table = reader.read_all()
+    assert count == 3
+    assert table.column("like_count").to_pylist() == [0, 1, 2]
+
+
+def test_empty_source(tmp_path):
+    assert asyncio.run(export_ndjson(records([]), str(tmp_path / "a.ndjson"))) == 0
+    assert (tmp_path / "a.ndjson").read_text() == ""
+
+    path = tmp_path / "a.parquet"
+    assert asyncio.run(export_parquet(records([]), str(path), model=Post)) == 0
+    assert pq.read_table(path).num_rows == 0
+
+    with pytest.raises(ValueError):
+        asyncio.run(export_parquet(records([]), str(tmp_path / "b.parquet")))
+    with pytest.raises(ValueError):
+        asyncio.run(export_arrow(records([]), str(tmp_path / "b.arrow")))
+    assert not (tmp_path / "b.parquet").exists()
@@ -0,0 +1,391 @@
+import time
+import asyncio
+import threading
+from typing import Optional
+
+import pytest
+import fakeredis
+from redis.asyncio import Redis
+
+from instagram_api import jobs
+from instagram_api.routes import InstagramAPI
+from instagram_api.breaker import CircuitBreaker, CircuitOpenError
+from instagram_api.jobs import (
+    DEAD_KEY,
+    PENDING_KEY,
+    ENQUEUE_SCRIPT,
+    PROMOTE_SCRIPT,
+    RELEASE_LEASE_SCRIPT,
+    RENEW_LEASE_SCRIPT,
+    CrawlJob,
+    CrawlQueue,
+    CrawlWorker,
+    run_workers,
+    shard_for,
+)
+
+from conftest import make_post
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jobs.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def redis_url():
+    # Worker processes need a server they can reach by URL
+    server = fakeredis.TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    yield f"redis://{host}:{port}"
+    server.shutdown()
+    server.server_close()
+
+
+def blocking_claims(queue: CrawlQueue):
+    # The stand-in doesn't block on an empty queue the way Redis does
+    claim = queue.claim
+
+    async def blocking_claim(shard):
+        claimed = await claim(shard)
+        if claimed is None:
+            await asyncio.sleep(0.01)
+        return claimed
+
+    queue.claim = blocking_claim
+
+
+class FakeAPI:
+    # Walks `pages` pages of posts and fails once on page `fail_at`
+    def __init__(self, pages: int, fail_at: Optional[int] = None):
+        self.pages = pages
+        self.fail_at = fail_at
+        self.fetched = []
+        self.error = Exception("upstream failed")
+
+    async def user_posts(
+        self, handle, max_pagination, cursor=None, on_page=None, allow_stale=True
+    ):
+        page = int(cursor or 0)
+        for _ in range(max_pagination):
+            if page == self.fail_at:
+                self.fail_at = None
+                raise self.error
+            self.fetched.append(page)
+            yield page
+            page += 1
+            next_cursor = str(page) if page < self.pages else None
+            await on_page(next_cursor)
+            if next_cursor is None:
+                break
+
+    user_followers = media_comments = user_posts
+
+
+def test_shard_for_is_stable():
+    targets = [f"account{i}" for i in range(2000)]
+    shards = [shard_for(target, 16) for target in targets]
+    assert shards == [shard_for(target, 16) for target in targets]
+    assert shard_for("Account1", 16) == shard_for("account1", 16)
+    assert set(shards) == set(range(16))
+
+    # Adding a shard only moves targets onto the new shard, about 1/17 of them
+    grown = [shard_for(target, 17) for target in targets]
+    moved = [new for old, new in zip(shards, grown) if old != new]
+    assert set(moved) == {16}
+    assert len(moved) == pytest.approx(len(targets) / 17, rel=0.3)
+
+
+def test_enqueue_dedupes_until_ack(redis):
+    queue = CrawlQueue(redis, shards=4)
+    job = CrawlJob(kind="user_posts", target="someone")
+    shard = queue.shard_for(job)
+
+    async def run():
+        assert await queue.enqueue(job)
+        assert not await queue.enqueue(CrawlJob(kind="user_posts", target="SOMEONE"))
+        assert await redis.llen(f"crawl:queue:{shard}") == 1
+        raw, claimed = await queue.claim(shard)
+        assert claimed.id == job.id
+        assert await redis.llen(f"crawl:processing:{shard}") == 1
+        await queue.ack(shard, raw, claimed)
+        assert await redis.llen(f"crawl:processing:{shard}") == 0
+        assert not await redis.sismember(PENDING_KEY, job.name)
+        assert await queue.enqueue(job)
+
+    asyncio.run(run())
+
+
+def test_retry_waits_for_backoff(redis, clock):
+    queue = CrawlQueue(redis, shards=1, retry_delay=5, max_retry_delay=15)
+    job = CrawlJob(kind="user_info", target="someone")
+
+    async def run():
+        await queue.enqueue(job)
+        raw, claimed = await queue.claim(0)
+        assert queue.backoff(claimed) == 5
+        await queue.retry(0, raw, claimed)
+        assert await redis.llen("crawl:processing:0") == 0
+        assert await queue.delayed(0) == 1
+
+        clock.now += 4.9
+        assert await queue.promote_due(0) == 0
+        clock.now += 0.1
+        assert await queue.promote_due(0) == 1
+        raw, claimed = await queue.claim(0)
+        assert claimed.attempts == 1
+        assert queue.backoff(claimed) == 10
+        assert queue.backoff(claimed.model_copy(update={"attempts": 5})) == 15
+
+    asyncio.run(run())
+
+
+def test_retry_dead_letters_after_max_attempts(redis):
+    queue = CrawlQueue(redis, shards=1, max_attempts=2, retry_delay=0)
+    job = CrawlJob(kind="user_info", target="someone")
+
+    async def run():
+        await queue.enqueue(job)
+        raw, claimed = await queue.claim(0)
+        await queue.retry(0, raw, claimed)
+        await queue.promote_due(0)
+        raw, claimed = await queue.claim(0)
+        assert claimed.attempts == 1
+        await queue.retry(0, raw, claimed)
+
+        assert await redis.llen("crawl:queue:0") == 0
+        assert await redis.llen("crawl:processing:0") == 0
+        assert await queue.delayed(0) == 0
+        dead = CrawlJob.model_validate_json(await redis.lindex(DEAD_KEY, 0))
+        assert dead.attempts == 2
+        assert not await redis.sismember(PENDING_KEY, job.name)
+
+    asyncio.run(run())
+
+
+def test_requeue_in_flight(redis):
+    queue = CrawlQueue(redis, shards=1)
+
+    async def run():
+        await queue.enqueue(CrawlJob(kind="user_info", target="a"))
+        await queue.enqueue(CrawlJob(kind="user_info", target="b"))
+        _, claimed = await queue.claim(0)
+        assert await queue.requeue_in_flight(0) == 1
+        _, again = await queue.claim(0)
+        assert again.id == claimed.id
+
+    asyncio.run(run())
+
+
+def test_worker_resumes_from_checkpoint(redis):
+    queue = CrawlQueue(redis, shards=1, retry_delay=0)
+    api = FakeAPI(pages=4, fail_at=2)
+    worker = CrawlWorker(api, queue, [0], stop_when_idle=True)
+    job = CrawlJob(kind="user_posts", target="someone", max_pagination=10)
+
+    async def run():
+        await queue.enqueue(job)
+        await worker.run()
+        assert await queue.get_checkpoint(job) == (None, 0)
+        assert not await redis.sismember(PENDING_KEY, job.name)
+
+    asyncio.run(run())
+    # The failed attempt fetched pages 0 and 1, the retry picked up at page 2
+    assert api.fetched == [0, 1, 2, 3]
+
+
+def test_open_circuit_does_not_use_an_attempt(redis, clock):
+    # The clock jumps below would otherwise run the shard lease out too
+    queue = CrawlQueue(
+        redis, shards=1, max_attempts=1, retry_delay=1, lease_duration=3600
+    )
+    api = FakeAPI(pages=1, fail_at=0)
+    api.error = CircuitOpenError("/v1/user_posts", 30)
+    worker = CrawlWorker(api, queue, [0], stop_when_idle=True)
+    job = CrawlJob(kind="user_posts", target="someone")
+    blocking_claims(queue)
+
+    async def run():
+        await queue.enqueue(job)
+        task = asyncio.create_task(worker.run())
+        while not await queue.delayed(0):
+            await asyncio.sleep(0.01)
+        # Held back for as long as the breaker stays open
+        clock.now += 29
+        assert await queue.promote_due(0) == 0
+        clock.now += 1
+        await asyncio.wait_for(task, 5)
+
+    asyncio.run(run())
+    assert api.fetched == [0]
+    assert asyncio.run(redis.llen(DEAD_KEY)) == 0
+    assert not asyncio.run(redis.sismember(PENDING_KEY, job.name))
+
+
+def test_worker_skips_stale_fallback(cache, redis):
+    asyncio.run(cache.cache_account_posts("someone", [make_post(0)], replace=True))
+    asyncio.run(cache.mark_stale("posts:someone"))
+
+    api = InstagramAPI("https://example.com", "key", "redis://localhost")
+    breaker = CircuitBreaker(min_calls=1)
+    breaker.record_failure(0.1)
+    api._breakers["/v1/user_posts"] = breaker
+    worker = CrawlWorker(api, CrawlQueue(redis, shards=1), [0])
+
+    # A plain read still gets the stale page, the crawl has to wait for the upstream
+    async def read():
+        return [post.id async for post in api.user_posts("someone")]
+
+    assert asyncio.run(read()) == ["0"]
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(worker.process(CrawlJob(kind="user_posts", target="someone")))
+
+
+def test_lease_has_one_owner(redis):
+    queue = CrawlQueue(redis, shards=1, lease_duration=0.05)
+
+    async def run():
+        assert await queue.acquire_lease(0, "a")
+        assert not await queue.acquire_lease(0, "b")
+        assert not await queue.renew_lease(0, "b")
+        assert await queue.renew_lease(0, "a")
+        await queue.release_lease(0, "b")
+        assert not await queue.acquire_lease(0, "b")
+        await queue.release_lease(0, "a")
+        assert await queue.acquire_lease(0, "b")
+        # Without a heartbeat the lease runs out and can be taken over
+        await asyncio.sleep(0.1)
+        assert await queue.acquire_lease(0, "a")
+
+    asyncio.run(run())
+
+
+def test_worker_leaves_leased_shard_alone(redis):
+    queue = CrawlQueue(redis, shards=1)
+    worker = CrawlWorker(FakeAPI(pages=1), queue, [0], stop_when_idle=True)
+
+    async def run():
+        await queue.enqueue(CrawlJob(kind="user_info", target="someone"))
+        await queue.claim(0)
+        assert await queue.acquire_lease(0, "other")
+        await worker.run()
+        # The job in flight belongs to the lease holder and stays where it is
+        assert await redis.llen("crawl:processing:0") == 1
+
+    asyncio.run(run())
+
+
+def test_worker_takes_over_expired_lease(redis):
+    queue = CrawlQueue(redis, shards=1, lease_duration=0.05)
+    api = FakeAPI(pages=1)
+    worker = CrawlWorker(api, queue, [0], stop_when_idle=True)
+
+    async def run():
+        await queue.enqueue(CrawlJob(kind="user_posts", target="someone"))
+        await queue.claim(0)
+        assert await queue.acquire_lease(0, "crashed")
+        await asyncio.sleep(0.1)
+        await worker.run()
+        assert await redis.llen("crawl:processing:0") == 0
+        assert not await redis.exists("crawl:lease:0")
+
+    asyncio.run(run())
+    assert api.fetched == [0]
+
+
+def test_worker_stops_when_lease_is_lost(redis):
+    queue = CrawlQueue(redis, shards=1, lease_duration=0.06)
+    blocking_claims(queue)
+    api = FakeAPI(pages=1)
+    worker = CrawlWorker(api, queue, [0])
+
+    async def run():
+        task = asyncio.create_task(worker.run())
+        while not await redis.exists("crawl:lease:0"):
+            await asyncio.sleep(0.01)
+        await redis.set("crawl:lease:0", "other", px=10_000)
+        await asyncio.sleep(0.1)
+        await queue.enqueue(CrawlJob(kind="user_posts", target="someone"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    assert api.fetched == []
+    assert asyncio.run(redis.get("crawl:lease:0")) == b"other"
+
+
+def test_failed_renewal_loses_the_lease(redis):
+    queue = CrawlQueue(redis, shards=1, lease_duration=0.03)
+    worker = CrawlWorker(FakeAPI(pages=1), queue, [0])
+
+    async def renew_lease(shard, owner):
+        raise ConnectionError("connection reset")
+
+    queue.renew_lease = renew_lease
+
+    async def run():
+        lost = asyncio.Event()
+        await asyncio.wait_for(worker._heartbeat(0, lost), 1)
+        return lost.is_set()
+
+    assert asyncio.run(run())
+
+
+def test_run_workers_drains_every_shard(redis_url):
+    jobs = [CrawlJob(kind="user_posts", target=f"account{i}") for i in range(8)]
+
+    async def setup():
+        redis = Redis.from_url(redis_url)
+        # The stand-in drops the connection on NOSCRIPT instead of letting
+        # the client load the script, so have them loaded up front
+        for script in (
+            ENQUEUE_SCRIPT,
+            PROMOTE_SCRIPT,
+            RENEW_LEASE_SCRIPT,
+            RELEASE_LEASE_SCRIPT,
+        ):
+            await redis.script_load(script)
+        queue = CrawlQueue(redis, shards=4)
+        for job in jobs:
+            await queue.enqueue(job)
+            # Fully walked already, the workers only have to ack
+            await queue.checkpoint(job, None, 1)
+        await redis.aclose()
+
+    async def remaining():
+        redis = Redis.from_url(redis_url)
+        keys = [
+            f"crawl:{kind}:{shard}"
+            for kind in ("queue", "processing")
+            for shard in range(4)
+        ]
+        counts = [await redis.llen(key) for key in keys]
+        pending = await redis.scard(PENDING_KEY)
+        leases = await redis.keys("crawl:lease:*")
+        await redis.aclose()
+        return sum(counts), pending, leases
+
+    asyncio.run(setup())
+    assert len({shard_for(job.target, 4) for job in jobs}) > 1
+    run_workers(
+        "https://example.com",
+        "key",
+        redis_url,
+        shards=4,
+        processes=2,
+        stop_when_idle=True,
+    )
+    assert asyncio.run(remaining()) == (0, 0, [])
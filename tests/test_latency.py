@@ -0,0 +1,50 @@
+from instagram_api.latency import LatencyHistogram, LatencyTracker
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for i in range(100):
+        histogram.record(i / 100)
+    assert histogram.percentile(0.5) == 0.5
+    assert histogram.percentile(0.99) == 0.99
+    assert histogram.percentile(1.0) == 0.99
+
+
+def test_histogram_keeps_recent_window():
+    histogram = LatencyHistogram(window=10)
+    for i in range(100):
+        histogram.record(i)
+    assert len(histogram) == 10
+    assert histogram.percentile(0.0) == 90
+
+
+def test_tracker_needs_min_samples():
+    tracker = LatencyTracker(min_samples=5, max_timeout=30.0)
+    for _ in range(4):
+        tracker.record("/v1/posts", 1.0)
+    assert tracker.percentile("/v1/posts", 0.95) is None
+    assert tracker.timeout("/v1/posts") == 30.0
+    tracker.record("/v1/posts", 1.0)
+    assert tracker.percentile("/v1/posts", 0.95) == 1.0
+
+
+def test_tracker_timeout_is_clamped():
+    tracker = LatencyTracker(
+        min_samples=1, timeout_multiplier=4.0, min_timeout=5.0, max_timeout=30.0
+    )
+    tracker.record("/fast", 0.1)
+    tracker.record("/normal", 2.0)
+    tracker.record("/slow", 20.0)
+    assert tracker.timeout("/fast") == 5.0
+    assert tracker.timeout("/normal") == 8.0
+    assert tracker.timeout("/slow") == 30.0
+
+
+def test_tracker_keeps_endpoints_apart():
+    tracker = LatencyTracker(min_samples=1)
+    tracker.record("/a", 1.0)
+    tracker.record("/b", 3.0)
+    snapshot = tracker.snapshot()
+    assert snapshot["/a"]["p99"] == 1.0
+    assert snapshot["/b"]["p99"] == 3.0
+    assert snapshot["/a"]["count"] == 1
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+from instagram_api import ratelimit
+from instagram_api.ratelimit import RateBudget
+
+
+@pytest.fixture(autouse=True)
+def frozen_time(monkeypatch):
+    # Keep every call in the same one second window
+    monkeypatch.setattr(ratelimit.time, "time", lambda: 1_700_000_000.5)
+
+
+def test_budget_is_shared(redis):
+    first = RateBudget(redis, 3)
+    second = RateBudget(redis, 3)
+
+    async def run():
+        return [
+            await first.try_acquire(),
+            await second.try_acquire(),
+            await first.try_acquire(),
+            await second.try_acquire(),
+        ]
+
+    assert asyncio.run(run()) == [True, True, True, False]
+
+
+def test_acquire_gives_up_after_timeout(redis):
+    budget = RateBudget(redis, 1)
+
+    async def run():
+        assert await budget.acquire()
+        return await budget.acquire(timeout=0)
+
+    assert asyncio.run(run()) is False
+
+
+def test_requests_per_second_must_be_positive(redis):
+    with pytest.raises(ValueError):
+        RateBudget(redis, 0)
@@ -0,0 +1,230 @@
+import asyncio
+
+import pytest
+
+from instagram_api.routes import InstagramAPI
+from instagram_api.deadline import Deadline
+from instagram_api.latency import LatencyTracker
+from instagram_api.breaker import CircuitBreaker, CircuitOpenError
+
+from conftest import make_post
+
+
+def posts_page(page: int, last: bool) -> dict:
+    user = make_post(0).user.model_dump()
+    return {
+        "status": "ok",
+        "message": None,
+        "data": {
+            "user": user,
+            "num_results": 1,
+            "items": [make_post(page).model_dump()],
+            "next_max_id": None if last else str(page + 1),
+        },
+    }
+
+
+def make_api(cache, pages):
+    api = InstagramAPI("https://example.com", "key", "redis://localhost")
+    api._cache = cache
+    calls = []
+
+    async def fake_get_page(session, url, headers, params, deadline):
+        calls.append(dict(params))
+        page = int(params.get("max_id", 0))
+        if page >= len(pages) or pages[page] is None:
+            deadline.partial = True
+            return None
+        return pages[page]
+
+    api._get_page = fake_get_page
+    return api, calls
+
+
+def test_walk_cut_by_deadline_is_not_cached_as_fresh(cache):
+    pages = [posts_page(0, False), posts_page(1, False), None]
+
+    async def run():
+        api, _ = make_api(cache, pages)
+        deadline = Deadline(60)
+        posts = [p.id async for p in api.user_posts("someone", 5, deadline=deadline)]
+        return posts, deadline
+
+    posts, deadline = asyncio.run(run())
+    assert posts == ["0", "1"]
+    assert deadline.partial
+    assert asyncio.run(cache.get_account_posts("someone")) is None
+    stale = asyncio.run(cache.get_account_posts("someone", allow_stale=True))
+    assert [post.id for post in stale] == ["0", "1"]
+
+
+def test_complete_walk_is_cached_as_fresh(cache):
+    pages = [posts_page(0, False), posts_page(1, True)]
+
+    async def run():
+        api, _ = make_api(cache, pages)
+        return [p.id async for p in api.user_posts("someone", 5)]
+
+    assert asyncio.run(run()) == ["0", "1"]
+    cached = asyncio.run(cache.get_account_posts("someone"))
+    assert [post.id for post in cached] == ["0", "1"]
+    assert asyncio.run(cache.cached_pages("posts:someone")) == 2
+
+
+def make_slow_api(seconds: float) -> InstagramAPI:
+    api = InstagramAPI("https://example.com", "key", "redis://localhost")
+    api._latency = LatencyTracker(min_timeout=0.01, max_timeout=0.05)
+
+    async def slow_fetch(session, url, headers, params, timeout):
+        await asyncio.wait_for(asyncio.sleep(seconds), timeout)
+        return {}
+
+    api._fetch_json = slow_fetch
+    return api
+
+
+def test_deadline_capped_timeout_is_not_a_latency_sample():
+    api = make_slow_api(1)
+    deadline = Deadline(0.01)
+
+    async def run():
+        return await api._get_page(
+            None, "https://example.com/v1/posts", {}, {}, deadline
+        )
+
+    assert asyncio.run(run()) is None
+    assert deadline.partial
+    assert api.metrics()["latency"] == {}
+
+
+def test_adaptive_timeout_is_a_latency_sample():
+    api = make_slow_api(1)
+
+    async def run():
+        return await api._get_page(None, "https://example.com/v1/posts", {}, {}, None)
+
+    with pytest.raises(Exception, match="timed out"):
+        asyncio.run(run())
+    assert api.metrics()["latency"]["/v1/posts"]["p99"] == 0.05
+
+
+def test_rejected_in_half_open_falls_back_to_stale(cache):
+    asyncio.run(cache.cache_account_posts("someone", [make_post(0)], replace=True))
+    asyncio.run(cache.mark_stale("posts:someone"))
+
+    api = InstagramAPI("https://example.com", "key", "redis://localhost")
+    api._cache = cache
+    breaker = CircuitBreaker(min_calls=1, open_duration=0)
+    breaker.record_failure(0.1)
+    # Another caller already holds the single trial call
+    assert breaker.allow_request()
+    assert breaker.state == "half_open"
+    api._breakers["/v1/user_posts"] = breaker
+
+    async def run():
+        return [post.id async for post in api.user_posts("someone")]
+
+    assert asyncio.run(run()) == ["0"]
+
+
+def test_rejected_without_stale_data_raises(cache):
+    api = InstagramAPI("https://example.com", "key", "redis://localhost")
+    api._cache = cache
+    breaker = CircuitBreaker(min_calls=1)
+    breaker.record_failure(0.1)
+    api._breakers["/v1/user_posts"] = breaker
+
+    async def run():
+        return [post.id async for post in api.user_posts("someone")]
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(run())
+
+
+class SlowBudget:
+    def __init__(self, wait: float):
+        self.wait = wait
+        self.acquired = 0
+
+    async def acquire(self, timeout=None) -> bool:
+        if timeout is not None and timeout < self.wait:
+            return False
+        await asyncio.sleep(self.wait)
+        self.acquired += 1
+        return True
+
+    async def try_acquire(self) -> bool:
+        return False
+
+
+def test_rate_budget_wait_is_not_upstream_latency():
+    api = make_slow_api(0)
+    api._rate_budget = SlowBudget(0.1)
+
+    async def run():
+        return await api._get_page(None, "https://example.com/v1/posts", {}, {}, None)
+
+    assert asyncio.run(run()) == {}
+    assert api._rate_budget.acquired == 1
+    assert api.metrics()["latency"]["/v1/posts"]["p99"] < 0.1
+
+
+def test_rate_budget_respects_deadline():
+    api = make_slow_api(0)
+    api._rate_budget = SlowBudget(10)
+    deadline = Deadline(0.1)
+
+    async def run():
+        return await api._get_page(
+            None, "https://example.com/v1/posts", {}, {}, deadline
+        )
+
+    assert asyncio.run(run()) is None
+    assert deadline.partial
+    assert api.metrics()["latency"] == {}
+
+
+def test_deadline_before_first_page_keeps_old_ttl(cache, redis):
+    async def run():
+        await cache.cache_account_posts("someone", [make_post(0)], replace=True)
+        await redis.expire("posts:someone", 5)
+        api, _ = make_api(cache, [None])
+        deadline = Deadline(60)
+        posts = [
+            p async for p in api.user_posts("someone", 5, deadline=deadline, cursor="0")
+        ]
+        return posts, await redis.ttl("posts:someone")
+
+    posts, ttl = asyncio.run(run())
+    assert posts == []
+    assert ttl <= 5
+
+
+class FixedLatency(LatencyTracker):
+    def percentile(self, endpoint, q):
+        return 0.001
+
+
+def test_hedge_budget_is_rolling():
+    api = InstagramAPI("https://example.com", "key", "redis://localhost")
+    api._latency = FixedLatency(window=40)
+    slow = False
+
+    async def fetch(session, url, headers, params, timeout):
+        if slow:
+            await asyncio.sleep(0.01)
+        return {}
+
+    api._fetch_json = fetch
+
+    async def run():
+        nonlocal slow
+        for _ in range(2000):
+            await api._hedged_fetch(None, "https://example.com/v1/posts", {}, {}, 30)
+        # A long calm stretch doesn't earn a slow burst any extra hedges
+        slow = True
+        for _ in range(40):
+            await api._hedged_fetch(None, "https://example.com/v1/posts", {}, {}, 30)
+
+    asyncio.run(run())
+    assert api.metrics()["hedges"] == 2
@@ -0,0 +1,84 @@
+import time
+import asyncio
+
+from instagram_api.tags import DAY, TagIndex, extract_hashtags, extract_mentions
+
+from conftest import make_post
+
+
+def test_extract_hashtags_and_mentions():
+    text = "Sunny #Beach day with @Alice and @bob. #beach #sun mail@example.com"
+    assert extract_hashtags(text) == ["beach", "sun"]
+    assert extract_mentions(text) == ["alice", "bob"]
+
+
+def test_index_counts_each_post_once(redis):
+    now = int(time.time())
+    index = TagIndex(redis)
+
+    async def run():
+        posts = [make_post(1, "#sun @alice", now), make_post(2, "#sun #sea", now)]
+        await index.add_posts(posts)
+        # Refreshing the cache indexes the same posts again
+        await index.add_posts(posts)
+        return (
+            await index.top_hashtags(),
+            await index.top_mentions(),
+            await index.posts_with_hashtag("#Sun"),
+        )
+
+    hashtags, mentions, posts = asyncio.run(run())
+    assert hashtags == [("sun", 2), ("sea", 1)]
+    assert mentions == [("alice", 1)]
+    assert [post_id for post_id, _ in posts] == ["2", "1"]
+
+
+def test_index_skips_posts_past_retention(redis):
+    now = int(time.time())
+    index = TagIndex(redis, retention=7 * DAY)
+
+    async def run():
+        await index.add_posts(
+            [make_post(1, "#old", now - 8 * DAY), make_post(2, "#new", now)]
+        )
+        return await index.top_hashtags(), await index.posts_with_hashtag("old")
+
+    hashtags, old = asyncio.run(run())
+    assert hashtags == [("new", 1)]
+    assert old == []
+
+
+def test_top_hashtags_in_time_range(redis):
+    now = int(time.time())
+    index = TagIndex(redis)
+
+    async def run():
+        await index.add_posts(
+            [
+                make_post(1, "#sun", now - 10 * DAY),
+                make_post(2, "#sea", now - 10 * DAY),
+                make_post(3, "#sea", now),
+            ]
+        )
+        return (
+            await index.top_hashtags(since=now - DAY),
+            await index.top_hashtags(until=now - 5 * DAY),
+            await index.top_hashtags(),
+        )
+
+    recent, older, everything = asyncio.run(run())
+    assert recent == [("sea", 1)]
+    assert sorted(older) == [("sea", 1), ("sun", 1)]
+    assert everything == [("sea", 2), ("sun", 1)]
+
+
+def test_counts_expire_with_the_index(redis):
+    now = int(time.time())
+    index = TagIndex(redis, retention=7 * DAY)
+
+    async def run():
+        await index.add_posts([make_post(1, "#sun", now)])
+        return await redis.ttl(f"hashtag_counts:{now // DAY}")
+
+    ttl = asyncio.run(run())
+    assert 7 * DAY < ttl <= 8 * DAY
@@ -0,0 +1,66 @@
+import asyncio
+
+from instagram_api import warmer as warmer_module
+from instagram_api.warmer import CacheWarmer
+
+from conftest import make_post
+
+
+class FakeAPI:
+    def __init__(self, cache, pages):
+        self.cache = cache
+        self.pages = pages
+        self.requested_depths = []
+
+    async def user_posts(self, handle, max_pagination=1, cache=True, on_page=None):
+        self.requested_depths.append(max_pagination)
+        for page in range(min(max_pagination, self.pages)):
+            yield make_post(page)
+            if on_page is not None:
+                last = page + 1 == min(max_pagination, self.pages)
+                await on_page(None if last else str(page + 1))
+
+
+def test_refresh_keeps_cached_depth(cache):
+    async def run():
+        for page in range(3):
+            await cache.cache_account_posts("someone", [make_post(page)], page == 0)
+        api = FakeAPI(cache, pages=5)
+        await CacheWarmer(api, requests_per_minute=60_000).refresh("posts:someone")
+        return api, await cache.get_account_posts("someone")
+
+    api, posts = asyncio.run(run())
+    assert api.requested_depths == [3]
+    assert [post.id for post in posts] == ["0", "1", "2"]
+    assert asyncio.run(cache.cached_pages("posts:someone")) == 3
+
+
+def test_refresh_paces_every_request(cache, monkeypatch):
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(warmer_module.asyncio, "sleep", fake_sleep)
+
+    async def run():
+        api = FakeAPI(cache, pages=4)
+        warmer = CacheWarmer(api, max_pagination=4, requests_per_minute=60)
+        await warmer.refresh("posts:someone")
+        return warmer
+
+    warmer = asyncio.run(run())
+    # One gap between each of the four page requests
+    assert sleeps == [warmer._min_spacing] * 3
+
+
+def test_warm_once_skips_missing_keys(cache, redis):
+    async def run():
+        await redis.zincrby("access_frequency", 5, "posts:gone")
+        api = FakeAPI(cache, pages=1)
+        warmer = CacheWarmer(api, requests_per_minute=60_000)
+        return api, await warmer.warm_once()
+
+    api, refreshed = asyncio.run(run())
+    assert refreshed == 0
+    assert api.requested_depths == []